@@ -0,0 +1,519 @@
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from informatica_shared.local_index import LocalVectorIndex
+from pymongo import ASCENDING, DESCENDING, MongoClient
+
+from settings.cache import TTLCache
+
+
+BENCH_MONGO_URI = os.environ.get("BENCH_MONGO_URI", "mongodb://localhost:27017")
+TOPICS = ["Minerals", "Technology", "Real Estate", "Politics", "Healthcare", "Energy", "Consumer Goods",
+          "Financial Services", "Telecommunications", "Utilities", "Electronics"]
+SOURCES = ["Yahoo News", "Google Finance"]
+
+
+class FakeAsyncOpenAI:
+    """Stand-in for AsyncOpenAI whose completions take a fixed time, optionally blocking the event loop."""
+
+    def __init__(self, latency=0.5, blocking=False):
+        self.latency = latency
+        self.blocking = blocking
+        self.calls = 0
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self._create))
+
+    async def _stream(self, content, chunks):
+        for i in range(chunks):
+            await asyncio.sleep(self.latency / chunks)
+            delta = types.SimpleNamespace(content=content[i * len(content) // chunks:(i + 1) * len(content) // chunks])
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)])
+
+    async def _create(self, model, messages, stream=False, **kwargs):
+        self.calls += 1
+        if stream:
+            return self._stream(f"Answer to: {messages[1]['content']} " * 20, chunks=20)
+        if self.blocking:
+            # What the synchronous OpenAI client did inside an async handler
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+        message = types.SimpleNamespace(content=f"Answer to: {messages[1]['content']}")
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+class FakeAsyncCollection:
+    """In-memory stand-in for an AsyncMongoClient collection keyed by user_id."""
+
+    def __init__(self, latency=0.005):
+        self.latency = latency
+        self.documents = {}
+
+    async def find_one(self, query, projection=None):
+        await asyncio.sleep(self.latency)
+        document = self.documents.get(query["user_id"])
+        return {"preference": document["preference"]} if document else None
+
+    async def update_one(self, query, update, upsert=False):
+        await asyncio.sleep(self.latency)
+        self.documents.setdefault(query["user_id"], {"user_id": query["user_id"]}).update(update["$set"])
+
+
+class FakeAsyncConversationCollection:
+    """In-memory stand-in for the conversations collection with versioned upserts."""
+
+    def __init__(self, latency=0.005):
+        self.latency = latency
+        self.documents = {}
+
+    async def find_one(self, query):
+        await asyncio.sleep(self.latency)
+        document = self.documents.get(query["_id"])
+        return dict(document) if document else None
+
+    async def update_one(self, query, update, upsert=False):
+        await asyncio.sleep(self.latency)
+        document = self.documents.get(query["_id"])
+        if document is not None and document["version"] != query["version"]:
+            return types.SimpleNamespace(matched_count=0, upserted_id=None)
+        self.documents[query["_id"]] = dict(update["$set"], _id=query["_id"])
+        return types.SimpleNamespace(matched_count=int(document is not None), upserted_id=None if document else query["_id"])
+
+
+class FakeAsyncNewsCollection:
+    """In-memory stand-in for the all_news collection, queried newest first by topic."""
+
+    def __init__(self, latency=0.005):
+        self.latency = latency
+        self.documents = []
+
+    def insert_many(self, documents):
+        self.documents.extend(documents)
+        self.documents.sort(key=lambda document: document["ingested_at"], reverse=True)
+
+    def find(self, query, projection=None):
+        collection = self
+
+        class Cursor:
+            limit_count = None
+
+            def sort(self, keys):
+                return self
+
+            def limit(self, count):
+                self.limit_count = count
+                return self
+
+            async def __aiter__(self):
+                await asyncio.sleep(collection.latency)
+                matched = [document for document in collection.documents
+                           if all(document.get(key) == value for key, value in query.items())]
+                for document in matched[:self.limit_count]:
+                    yield {key: value for key, value in document.items() if not projection or projection.get(key)}
+
+        return Cursor()
+
+
+class FakeFirecrawlApp:
+    """Stand-in for FirecrawlApp with a fixed scrape latency."""
+
+    latency = 0.3
+    calls = 0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def scrape_url(self, url, params=None):
+        FakeFirecrawlApp.calls += 1
+        time.sleep(self.latency)
+        return {"markdown": f"Latest headlines for {url}"}
+
+
+class FakeMilvus:
+    """Stand-in for the Milvus vector store with a fixed search latency."""
+
+    latency = 0.05
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def similarity_search(self, query, **kwargs):
+        time.sleep(self.latency)
+        return []
+
+
+def load_app_with_stubs(llm, collection, news=None):
+    from informatica_shared.resources import RESOURCES
+
+    RESOURCES.set("openai", llm)
+    RESOURCES.set("mongo", {"informatica_ai": {"user_preferences": collection, "all_news": news or FakeAsyncNewsCollection(),
+                                               "conversations": FakeAsyncConversationCollection(latency=collection.latency)}})
+    RESOURCES.set("firecrawl", FakeFirecrawlApp())
+    RESOURCES.set("vector_store", FakeMilvus())
+    import main
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("settings.utils").setLevel(logging.CRITICAL)
+    main.preference_cache.ttl = 0
+    return main.app
+
+
+@contextmanager
+def serve(app):
+    """Run the app on a local port in a background thread, like a single gunicorn worker."""
+    import uvicorn
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+async def _drive(base_url, requests, concurrency):
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(client, i):
+        async with semaphore:
+            started = time.perf_counter()
+            if i % 2:
+                response = await client.post("/financial_bot/v1/chat", params={"message": f"question {i}"})
+            else:
+                response = await client.get("/financial_bot/v1/get_user_preference", params={"email_id": f"user{i % 100}@example.com"})
+            if response.status_code >= 500:
+                raise RuntimeError(f"Request {i} failed: {response.text}")
+            latencies.append(time.perf_counter() - started)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[one(client, i) for i in range(requests)])
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return requests / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]
+
+
+def bench_chat_concurrency(requests, concurrency, llm_latency):
+    llm = FakeAsyncOpenAI(latency=llm_latency)
+    collection = FakeAsyncCollection()
+    for i in range(0, 100, 2):
+        collection.documents[f"user{i}@example.com"] = {"preference": '{"topics": ["Energy"]}'}
+    app = load_app_with_stubs(llm, collection)
+    print(f"{'client':>9} {'req/s':>8} {'p50_ms':>8} {'p95_ms':>8}")
+    for blocking in (True, False):
+        llm.blocking = blocking
+        with serve(app) as base_url:
+            throughput, p50, p95 = asyncio.run(_drive(base_url, requests, concurrency))
+        print(f"{'blocking' if blocking else 'async':>9} {throughput:>8.1f} {p50 * 1000:>8.1f} {p95 * 1000:>8.1f}")
+
+
+async def _first_byte(base_url, path, requests, concurrency):
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    first_byte, total = [], []
+
+    async def one(client, i):
+        async with semaphore:
+            started = time.perf_counter()
+            first = None
+            async with client.stream("POST", path, params={"message": f"question {i}"}) as response:
+                async for chunk in response.aiter_bytes():
+                    if first is None and chunk:
+                        first = time.perf_counter() - started
+            elapsed = time.perf_counter() - started
+            # One sample per request, an empty body counts as arriving at the end
+            first_byte.append(elapsed if first is None else first)
+            total.append(elapsed)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+        await asyncio.gather(*[one(client, i) for i in range(requests)])
+    return statistics.median(first_byte), statistics.median(total)
+
+
+def bench_chat_streaming(requests, concurrency, llm_latency):
+    app = load_app_with_stubs(FakeAsyncOpenAI(latency=llm_latency), FakeAsyncCollection())
+    print(f"{'endpoint':>22} {'first_byte_ms':>14} {'total_ms':>9}")
+    for path in ("/financial_bot/v1/chat", "/financial_bot/v1/chat/stream"):
+        with serve(app) as base_url:
+            first_byte, total = asyncio.run(_first_byte(base_url, path, requests, concurrency))
+        print(f"{path.rsplit('/v1', 1)[1]:>22} {first_byte * 1000:>14.1f} {total * 1000:>9.1f}")
+
+
+def bench_news_summarizer(requests, concurrency, tickers):
+    llm = FakeAsyncOpenAI(latency=0.5)
+    app = load_app_with_stubs(llm, FakeAsyncCollection())
+
+    async def drive(base_url):
+        import httpx
+
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one(client, i):
+            async with semaphore:
+                started = time.perf_counter()
+                await client.post("/financial_bot/v1/chat", params={"message": f"How is {i % tickers} doing?", "stock_name": f"TICK{i % tickers}"})
+                latencies.append(time.perf_counter() - started)
+
+        async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+            await asyncio.gather(*[one(client, i) for i in range(requests)])
+        return statistics.median(latencies)
+
+    with serve(app) as base_url:
+        p50 = asyncio.run(drive(base_url))
+    # Every chat request makes one o3-mini call, the rest are news summaries
+    print(f"{requests} chat requests over {tickers} tickers: p50 {p50 * 1000:.1f} ms, "
+          f"{FakeFirecrawlApp.calls} scrapes, {llm.calls - requests} summaries")
+
+
+def _timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def _article(cycle, i, source):
+    return {
+        "title": f"Headline {cycle}-{i}",
+        "summary": f"Summary of story {i} in cycle {cycle}.",
+        "link": f"https://news.example.com/{cycle}/{i}",
+        "topic": TOPICS[(cycle + i) % len(TOPICS)],
+        "source": source,
+    }
+
+
+def seed_news(db, cycles, items_per_source):
+    legacy, articles = db["bench_all_news_legacy"], db["bench_all_news"]
+    legacy.drop()
+    articles.drop()
+    started = datetime.now(timezone.utc) - timedelta(hours=6 * cycles)
+    for cycle in range(cycles):
+        ingested_at = started + timedelta(hours=6 * cycle)
+        items = {source: [_article(cycle, i, source) for i in range(items_per_source)] for source in SOURCES}
+        legacy.insert_one({source: [{k: v for k, v in item.items() if k != "source"} for item in source_items]
+                           for source, source_items in items.items()})
+        articles.insert_many([dict(item, ingested_at=ingested_at, cycle_id=str(cycle))
+                              for source_items in items.values() for item in source_items])
+    articles.create_index([("topic", ASCENDING), ("ingested_at", DESCENDING)])
+    articles.create_index([("source", ASCENDING), ("ingested_at", DESCENDING)])
+    articles.create_index([("ingested_at", DESCENDING)])
+    return legacy, articles
+
+
+def bench_news_snippets(db, cycles, items_per_source, repeat):
+    legacy, articles = seed_news(db, cycles, items_per_source)
+    topic = TOPICS[1]
+
+    def legacy_pipeline():
+        return list(legacy.aggregate([
+            {"$sort": {"_id": -1}},
+            {"$limit": 10},
+            {"$project": {"_id": 0}},
+            {"$replaceRoot": {"newRoot": {"$mergeObjects": [{"news_sources": {"$objectToArray": "$$ROOT"}}, {"_id": "$_id"}]}}},
+            {"$unwind": "$news_sources"},
+            {"$project": {"source": "$news_sources.k", "articles": "$news_sources.v"}},
+            {"$unwind": "$articles"},
+            {"$match": {"articles.topic": topic}},
+            {"$group": {"_id": "$source", "articles": {"$push": "$articles"}}},
+            {"$project": {"_id": 0, "source": "$_id", "articles": 1}},
+        ]))
+
+    def article_query():
+        projection = {"_id": 0, "title": 1, "summary": 1, "link": 1, "topic": 1, "source": 1}
+        return list(articles.find({"topic": topic}, projection).sort([("ingested_at", -1)]).limit(200))
+
+    plan = articles.find({"topic": topic}).sort([("ingested_at", -1)]).limit(200).explain()
+    print(f"Seeded {cycles} cycles x {items_per_source * len(SOURCES)} articles")
+    print(f"legacy $objectToArray pipeline: {_timed(legacy_pipeline, repeat):.2f} ms")
+    print(f"per-article topic query:        {_timed(article_query, repeat):.2f} ms "
+          f"(winning plan: {plan['queryPlanner']['winningPlan'].get('inputStage', {}).get('stage')})")
+
+
+def bench_user_preferences(db, user_counts, lookups):
+    preferences = db["bench_user_preferences"]
+    preferences.drop()
+    preferences.create_index("user_id", unique=True)
+    cache = TTLCache(ttl=60)
+    seeded = 0
+    print(f"{'users':>9} {'distinct+find_one_ms':>21} {'find_one_ms':>12} {'cached_ms':>10}")
+    for count in user_counts:
+        for start in range(seeded, count, 10000):
+            preferences.insert_many([{"user_id": f"user{i}@example.com", "preference": '{"topics": ["Energy"]}'}
+                                     for i in range(start, min(start + 10000, count))], ordered=False)
+        seeded = count
+        hot_users = [f"user{(i * 7919) % count}@example.com" for i in range(lookups)]
+
+        def distinct_lookup():
+            # What get_user_preference did before the unique index
+            for user in hot_users[:10]:
+                if user in preferences.distinct("user_id"):
+                    preferences.find_one({"user_id": user}, {"_id": 0, "preference": 1})
+
+        def indexed_lookup():
+            for user in hot_users:
+                preferences.find_one({"user_id": user}, {"_id": 0, "preference": 1})
+
+        def cached_lookup():
+            for user in hot_users:
+                if cache.get(user) is None:
+                    cache.set(user, preferences.find_one({"user_id": user}, {"_id": 0, "preference": 1}))
+
+        try:
+            legacy = f"{_timed(distinct_lookup, 1) / 10:.3f}"
+        except Exception as e:
+            # distinct fails outright once the user ids no longer fit in a 16 MB document
+            legacy = type(e).__name__
+        indexed = _timed(indexed_lookup, 3) / lookups
+        cached = _timed(cached_lookup, 3) / lookups
+        print(f"{count:>9} {legacy:>21} {indexed:>12.3f} {cached:>10.3f}")
+
+
+def _percentiles(timings):
+    timings = sorted(timings)
+    return timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.95)] * 1000
+
+
+def bench_retrieval(documents, dim, queries, k, remote_latency, hybrid_alpha):
+    """Recall and latency of the local index against exact search, and latency against a remote round trip."""
+    rng = np.random.default_rng(0)
+    # Clustered vectors, like embeddings of related headlines
+    centers = rng.normal(size=(max(1, documents // 50), dim))
+    vectors = (centers[rng.integers(0, len(centers), documents)] + rng.normal(scale=0.5, size=(documents, dim))).astype(np.float32)
+    texts = [f"Headline about ticker{i} and {TOPICS[i % len(TOPICS)]}" for i in range(documents)]
+    metadatas = [{"topic": TOPICS[i % len(TOPICS)]} for i in range(documents)]
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    with tempfile.TemporaryDirectory() as path:
+        started = time.perf_counter()
+        LocalVectorIndex(path).add_embeddings(texts, vectors, metadatas)
+        load = time.perf_counter()
+        index = LocalVectorIndex(path, hybrid_alpha=hybrid_alpha)
+        len(index)
+        print(f"Indexed {documents} x {dim} vectors in {load - started:.2f}s, a reader loaded them in {time.perf_counter() - load:.2f}s")
+
+        targets = rng.integers(0, documents, queries)
+        # Noisy queries, the target article is what the question is about
+        query_vectors = vectors[targets] + rng.normal(scale=0.35, size=(queries, dim)).astype(np.float32)
+        results = {"local vector": [], "local hybrid": [], "local topic filter": [], "remote round trip": []}
+        recall = hits = hybrid_hits = 0
+        for target, vector in zip(targets, query_vectors):
+            exact = set(np.argsort(-(normalized @ (vector / np.linalg.norm(vector))))[:k])
+
+            started = time.perf_counter()
+            found = index.search(vector, k=k)
+            results["local vector"].append(time.perf_counter() - started)
+            found_texts = {document.page_content for document, _ in found}
+            recall += len(found_texts & {texts[i] for i in exact}) / k
+            hits += texts[target] in found_texts
+
+            started = time.perf_counter()
+            found = index.search(vector, k=k, query=f"news on ticker{target}")
+            results["local hybrid"].append(time.perf_counter() - started)
+            hybrid_hits += texts[target] in {document.page_content for document, _ in found}
+
+            started = time.perf_counter()
+            index.search(vector, k=k, topics=[TOPICS[target % len(TOPICS)]])
+            results["local topic filter"].append(time.perf_counter() - started)
+
+            # Zilliz does the same exact search server side, plus the network round trip
+            started = time.perf_counter()
+            np.argsort(-(normalized @ vector))[:k]
+            time.sleep(remote_latency)
+            results["remote round trip"].append(time.perf_counter() - started)
+
+        print(f"Local recall@{k} against exact search: {recall / queries:.3f}, target article found by "
+              f"vector search {hits / queries:.0%}, hybrid (alpha {hybrid_alpha}) {hybrid_hits / queries:.0%}")
+        for name, timings in results.items():
+            p50, p95 = _percentiles(timings)
+            print(f"{name:>20}: p50 {p50:.2f} ms, p95 {p95:.2f} ms")
+
+
+# Read by the client factories, none of them should be needed to boot a worker
+CREDENTIALS = ("MONGO_URI", "OPENAI_API_KEY", "FIRECRAWL_KEY", "ZILLIZ_TOKEN")
+
+_BOOT = """
+import asyncio, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+import httpx
+async def first_request():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://worker") as client:
+        return (await client.get("/")).status_code
+status = asyncio.run(first_request())
+print(imported - started, time.perf_counter() - started, status)
+"""
+
+
+def bench_startup(repeat):
+    # A fresh interpreter per run like a new gunicorn worker, with no credentials in its environment
+    env = {name: value for name, value in os.environ.items() if name not in CREDENTIALS}
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", _BOOT], cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                                capture_output=True, text=True)
+        process_elapsed = time.perf_counter() - started
+        if result.returncode:
+            print(f"Booting a worker without credentials failed: {result.stderr.strip().splitlines()[-1]}")
+            return
+        imported, first_response, status = result.stdout.split()
+        timings.append((float(imported), float(first_response), process_elapsed))
+    print(f"Worker boot without credentials: import main {statistics.median(t[0] for t in timings) * 1000:.0f}ms, "
+          f"first response (status {status}) {statistics.median(t[1] for t in timings) * 1000:.0f}ms, "
+          f"{statistics.median(t[2] for t in timings) * 1000:.0f}ms with interpreter startup (median of {repeat})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the chat API with stubbed backends and its queries against a local MongoDB")
+    parser.add_argument("--cycles", type=int, default=2000)
+    parser.add_argument("--items", type=int, default=20, help="Articles per source per cycle")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per chat load test run")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--skip-mongo", action="store_true", help="Only run the stubbed load test")
+    parser.add_argument("--documents", type=int, default=100000, help="Vectors in the retrieval benchmark")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--remote-latency", type=float, default=0.08, help="Zilliz round trip in seconds")
+    parser.add_argument("--hybrid-alpha", type=float, default=0.7)
+    parser.add_argument("--startup-repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    bench_startup(args.startup_repeat)
+    bench_chat_concurrency(args.requests, args.concurrency, args.llm_latency)
+    bench_chat_streaming(args.requests, args.concurrency, args.llm_latency)
+    bench_news_summarizer(args.requests, args.concurrency, tickers=5)
+    bench_retrieval(args.documents, args.dim, args.queries, 5, args.remote_latency, args.hybrid_alpha)
+    if not args.skip_mongo:
+        db = MongoClient(BENCH_MONGO_URI)["informatica_ai_bench"]
+        bench_news_snippets(db, args.cycles, args.items, args.repeat)
+        bench_user_preferences(db, args.users, args.lookups)
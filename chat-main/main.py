@@ -1,24 +1,78 @@
-from dns.e164 import query
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import logging
-from openai import OpenAI
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
-from pymongo import MongoClient
-from certifi import where
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import os
+import json
+import time
 
-from settings.utils import json_cleaner, news_summarizer
+from settings.utils import json_cleaner, news_summarizer, StreamCleaner
+from informatica_shared.instrumentation import histogram, record_llm_usage, render_metrics, share_metrics, span, trace
+from settings.cache import TTLCache
+from settings.conversations import ConversationStore
+from settings.clients import database, mongo, openai_client
+from informatica_shared.resources import resource
+from informatica_shared.tokens import load_encoding
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CONVERSATION_SUMMARY_MODEL = os.environ.get("CONVERSATION_SUMMARY_MODEL", "gpt-4o-mini")
+NEWS_SUMMARIZER_ENABLED = os.environ.get("NEWS_SUMMARIZER_ENABLED", "true").lower() == "true"
+
+http_request_duration = histogram("http_request_duration_seconds", "Duration of API requests until the response starts",
+                                  ("method", "route", "status"))
+
+async def summarize_conversation(summary, turns):
+    started = time.perf_counter()
+    completion = await openai_client.get().chat.completions.create(
+        model=CONVERSATION_SUMMARY_MODEL,
+        messages=[
+            {'role': 'system', 'content': 'You summarize a conversation between a user and a financial advisor in under 150 words, keeping the stocks, figures and user interests mentioned.'},
+            {'role': 'user', 'content': f'Summary so far - {summary}'},
+            {'role': 'user', 'content': f'Newer conversation - {"".join(turns)}'}
+        ]
+    )
+    record_llm_usage(CONVERSATION_SUMMARY_MODEL, "conversation_summary", time.perf_counter() - started, getattr(completion, "usage", None))
+    return completion.choices[0].message.content
+
+conversation_store = resource("conversation_store", lambda: ConversationStore(database()["conversations"], summarize=summarize_conversation),
+                              requires=(mongo,))
+
+# Read-through cache for hot users, invalidated on write in this worker and expiring across workers
+preference_cache = TTLCache(maxsize=int(os.environ.get("USER_PREFERENCE_CACHE_SIZE", 10000)),
+                            ttl=float(os.environ.get("USER_PREFERENCE_CACHE_TTL", 60)))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Downloads the encoding on a cold cache, before requests count conversation tokens
+    await asyncio.to_thread(load_encoding)
+    # With METRICS_MULTIPROC_DIR set, /metrics on any gunicorn worker covers all of them
+    share_metrics()
+    try:
+        await database()["user_preferences"].create_index("user_id", unique=True)
+    except Exception as e:
+        logger.error(f"Error creating user_id index on user_preferences: {str(e)}")
+    try:
+        await conversation_store.get().ensure_indexes()
+    except Exception as e:
+        logger.error(f"Error creating conversation indexes: {str(e)}")
+    yield
+    # Only the clients this worker created
+    if openai_client.peek() is not None:
+        await openai_client.peek().close()
+    if mongo.peek() is not None:
+        await mongo.peek().close()
+
 app = FastAPI(
     title="Financial_Bot",
     description="APIs for Financial Bot",
     version="1.0.0",
     openapi_url="/openapi.json",
-    docs_url="/"
+    docs_url="/",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -29,59 +83,165 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-client = OpenAI()
-mongo_client = MongoClient(os.environ["MONGO_URI"], tlsCAFile=where())
-db = mongo_client["informatica_ai"]
-user_preferences_db = db["user_preferences"]
-all_news_db = db["all_news"]
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    # Continue the caller's trace when it sends one, and tell it which trace the request ran in
+    with trace(request.headers.get("x-trace-id")) as trace_id:
+        started = time.perf_counter()
+        response = await call_next(request)
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        http_request_duration.observe(time.perf_counter() - started, method=request.method, route=route, status=response.status_code)
+        response.headers["X-Trace-Id"] = trace_id
+        return response
 
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
 
+@app.get("/metrics")
+async def metrics():
+    # Every worker added up when METRICS_MULTIPROC_DIR is set, otherwise only this worker process
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+def chat_messages(message, history_str, stock_name, current_news):
+    return [
+        {'role': 'system', 'content': 'You are a financial advisor, who is provided with information from multiple news sources & Vector Database around the message of User. Analyze the information snippets, and give a clear & crisp answer with reasons.'},
+        {'role': 'user', 'content': f'Current User Message {message}'},
+        {'role': 'user', 'content': f'User is particularly interested in Stock - {stock_name}'},
+        {'role': 'user', 'content': f'Conversation History so far - {history_str}'},
+        {'role': 'system', 'content': f'Latest Content from Yahoo Finance {current_news}'}
+
+    ]
+
+async def load_history(session_id, history):
+    """
+    Conversation of the session and its history for the prompt.
+
+    Without a session id a new session is started, with the history the client sent as the
+    prompt history of its first turn. Returns no conversation for an unknown session id.
+    """
+    if session_id is None:
+        return conversation_store.get().create(), "".join(history[::-1])
+    with span("mongo", operation="load_conversation"):
+        conversation = await conversation_store.get().load(session_id)
+    if conversation is None:
+        return None, None
+    return conversation, conversation_store.get().prompt_history(conversation)
+
+def unknown_session():
+    return JSONResponse(content={"message": "Unknown or expired session_id, send the message without one to start a new session"}, status_code=404)
+
+async def save_turn(conversation, message, response_content, history, stock_name, current_news):
+    prompt_tokens_saved = await conversation_store.get().prompt_tokens_saved(conversation)
+    with span("mongo", operation="append_conversation"):
+        await conversation_store.get().append(conversation, message, response_content)
+    session_id = conversation["_id"]
+    logger.info(f"Session {session_id[:8]} saved {prompt_tokens_saved} prompt tokens")
+    content = {"message": response_content, "session_id": session_id, "stock_name": stock_name, "current_news": current_news, "prompt_tokens_saved": prompt_tokens_saved}
+    if history:
+        # Clients that keep their own history get it back with this turn added
+        content["history"] = history + [str({message:response_content})]
+    return content
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.post("/financial_bot/v1/chat")
-async def chat(message:str, history: list[str] =[], stock_name:str=None, current_news:str=None):
+async def chat(message:str, history: list[str] =[], stock_name:str=None, current_news:str=None, session_id:str=None):
 
     try:
         if message is None:
             return JSONResponse(content={"message": "Message is required"}, status_code=400)
 
-        # if current_news is None:
-        #     current_news = news_summarizer(query=message, stock_name=stock_name)
-        history_str = "".join(history[::-1])
+        conversation, history_str = await load_history(session_id, history)
+        if conversation is None:
+            return unknown_session()
+        if current_news is None and NEWS_SUMMARIZER_ENABLED:
+            current_news = await news_summarizer(query=message, stock_name=stock_name)
 
         if stock_name is None:
             stock_name = "All stock information, no specific stock mentioned"
 
-        completion = client.chat.completions.create(
+        started = time.perf_counter()
+        completion = await openai_client.get().chat.completions.create(
             model='o3-mini',
-            messages=[
-                {'role': 'system', 'content': 'You are a financial advisor, who is provided with information from multiple news sources & Vector Database around the message of User. Analyze the information snippets, and give a clear & crisp answer with reasons.'},
-                {'role': 'user', 'content': f'Current User Message {message}'},
-                {'role': 'user', 'content': f'User is particularly interested in Stock - {stock_name}'},
-                {'role': 'user', 'content': f'Conversation History so far - {history_str}'},
-                {'role': 'system', 'content': f'Latest Content from Yahoo Finance {current_news}'}
-
-            ]
+            messages=chat_messages(message, history_str, stock_name, current_news)
         )
+        record_llm_usage("o3-mini", "chat", time.perf_counter() - started, getattr(completion, "usage", None))
         response_content = json_cleaner(completion.choices[0].message.content)
-        history.append(str({message:response_content}))
-        return JSONResponse(content={"message": response_content, "history": history, "stock_name": stock_name, "current_news": current_news}, status_code=200)
+        content = await save_turn(conversation, message, response_content, history, stock_name, current_news)
+        return JSONResponse(content=content, status_code=200)
 
     except Exception as e:
         logger.error(f"Error in processing request chat: {str(e)}")
         return JSONResponse(content={"message": "Internal Server Error"}, status_code=500)
 
+@app.post("/financial_bot/v1/chat/stream")
+async def chat_stream(message:str, history: list[str] =[], stock_name:str=None, current_news:str=None, session_id:str=None):
+    """
+    Server-sent events variant of chat.
+
+    Streams "token" events with cleaned text as the completion is generated, then a single
+    "done" event with the same fields chat returns, or an "error" event.
+    """
+    if message is None:
+        return JSONResponse(content={"message": "Message is required"}, status_code=400)
+
+    try:
+        # Checked before the stream starts, so an unknown session is a plain 404
+        conversation, history_str = await load_history(session_id, history)
+    except Exception as e:
+        logger.error(f"Error in processing request chat_stream: {str(e)}")
+        return JSONResponse(content={"message": "Internal Server Error"}, status_code=500)
+    if conversation is None:
+        return unknown_session()
+
+    ticker = stock_name
+    if stock_name is None:
+        stock_name = "All stock information, no specific stock mentioned"
+
+    async def events():
+        nonlocal current_news
+        try:
+            if current_news is None and NEWS_SUMMARIZER_ENABLED:
+                current_news = await news_summarizer(query=message, stock_name=ticker)
+            started = time.perf_counter()
+            stream = await openai_client.get().chat.completions.create(
+                model='o3-mini',
+                messages=chat_messages(message, history_str, stock_name, current_news),
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            cleaner = StreamCleaner()
+            usage = None
+            async for chunk in stream:
+                # Usage comes in a last chunk without choices
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                text = cleaner.feed(chunk.choices[0].delta.content)
+                if text:
+                    yield sse_event("token", {"content": text})
+
+            record_llm_usage("o3-mini", "chat_stream", time.perf_counter() - started, usage)
+            response_content = cleaner.result()
+            yield sse_event("done", await save_turn(conversation, message, response_content, history, stock_name, current_news))
+
+        except Exception as e:
+            logger.error(f"Error in processing request chat_stream: {str(e)}")
+            yield sse_event("error", {"message": "Internal Server Error"})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/financial_bot/v1/add_user_preference")
 async def add_user_preference(email_id:str, preference:str):
     try:
         if email_id is None or preference is None:
             return JSONResponse(content={"message": "User ID and Preference are required"}, status_code=400)
         else:
-            if email_id in user_preferences_db.distinct("user_id"):
-                user_preferences_db.update_one({"user_id": email_id}, {"$set": {"preference": preference}})
-            else:
-                user_preferences_db.insert_one({"user_id": email_id, "preference": preference})
+            with span("mongo", operation="upsert_user_preference"):
+                await database()["user_preferences"].update_one({"user_id": email_id}, {"$set": {"preference": preference}}, upsert=True)
+            preference_cache.invalidate(email_id)
             return JSONResponse(content={"message": "User preference added successfully"}, status_code=200)
 
     except Exception as e:
@@ -94,8 +254,13 @@ async def get_user_preference(email_id:str):
         if email_id is None:
             return JSONResponse(content={"message": "User ID is required"}, status_code=400)
         else:
-            if email_id in user_preferences_db.distinct("user_id"):
-                preference = user_preferences_db.find_one({"user_id": email_id}, {"_id": 0, "preference": 1})
+            preference = preference_cache.get(email_id)
+            if preference is None:
+                with span("mongo", operation="find_user_preference"):
+                    preference = await database()["user_preferences"].find_one({"user_id": email_id}, {"_id": 0, "preference": 1})
+                if preference is not None:
+                    preference_cache.set(email_id, preference)
+            if preference is not None:
                 return JSONResponse(content={"message": preference}, status_code=200)
             else:
                 return JSONResponse(content={"message": "User preference not found"}, status_code=404)
@@ -105,25 +270,17 @@ async def get_user_preference(email_id:str):
         return JSONResponse(content={"message": "Internal Server Error"}, status_code=500)
 
 @app.get("/financial_bot/v1/get_latest_news_snippets")
-async def get_latest_news_snippets(topic: str = None):
+async def get_latest_news_snippets(topic: str = None, limit: int = 200):
     try:
-        pipeline = [
-            {"$sort": {"_id": -1}},
-            {"$limit": 10},
-            {"$project": {"_id": 0}},
-            {"$replaceRoot": {"newRoot": {"$mergeObjects": [
-                {"news_sources": {"$objectToArray": "$$ROOT"}},
-                {"_id": "$_id"}
-            ]}}},
-            {"$unwind": "$news_sources"},
-            {"$project": {"source": "$news_sources.k", "articles": "$news_sources.v"}},
-            {"$unwind": "$articles"},
-            {"$match": {"articles.topic": topic}} if topic else {"$match": {}},
-            {"$group": {"_id": "$source", "articles": {"$push": "$articles"}}},
-            {"$project": {"_id": 0, "source": "$_id", "articles": 1}}
-        ]
+        # One document per article, a topic filter is a range scan on (topic, ingested_at)
+        query = {"topic": topic} if topic else {}
+        projection = {"_id": 0, "title": 1, "summary": 1, "link": 1, "topic": 1, "source": 1}
+        articles_by_source = {}
+        with span("mongo", operation="latest_news_snippets"):
+            async for article in database()["all_news"].find(query, projection).sort([("ingested_at", -1)]).limit(limit):
+                articles_by_source.setdefault(article.pop("source"), []).append(article)
 
-        news_snippets = list(all_news_db.aggregate(pipeline))
+        news_snippets = [{"source": source, "articles": articles} for source, articles in articles_by_source.items()]
 
         return JSONResponse(content={"message": news_snippets}, status_code=200)
 
@@ -139,6 +296,7 @@ async def get_latest_news_snippets(topic: str = None):
 #
 #     uvicorn.run(app, host="127.0.0.1", port=8000)
 # command to run on server gunicorn -w 4 -k uvicorn.workers.UvicornWorker main:app
+# with METRICS_MULTIPROC_DIR set to a directory emptied before each start
 
 
 
@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from informatica_shared.baseline import compare_to_baseline
+
+from benchmark import (SOURCES, TOPICS, FakeAsyncCollection, FakeAsyncNewsCollection, FakeAsyncOpenAI, FakeFirecrawlApp,
+                       FakeMilvus, _article, load_app_with_stubs, serve)
+
+
+# Share of the requests going to each endpoint, close to what the web client sends
+WORKLOAD = {"chat": 0.35, "chat_stream": 0.2, "get_user_preference": 0.3, "add_user_preference": 0.05,
+            "get_latest_news_snippets": 0.1}
+
+
+def load_app(args):
+    llm = FakeAsyncOpenAI(latency=args.llm_latency)
+    preferences = FakeAsyncCollection(latency=args.mongo_latency)
+    rng = random.Random(args.seed)
+    for i in range(args.users):
+        preferences.documents[f"user{i}@example.com"] = {"preference": json.dumps({"topics": rng.sample(TOPICS, rng.randint(1, 3))})}
+    news = FakeAsyncNewsCollection(latency=args.mongo_latency)
+    started = datetime.now(timezone.utc) - timedelta(hours=6)
+    news.insert_many([dict(_article(i // 100, i, SOURCES[i % len(SOURCES)]), ingested_at=started + timedelta(seconds=i))
+                      for i in range(args.articles)])
+    FakeFirecrawlApp.latency = args.scrape_latency
+    FakeMilvus.latency = args.vector_latency
+
+    app = load_app_with_stubs(llm, preferences, news)
+    import main
+    main.preference_cache.ttl = args.preference_cache_ttl
+    return app, llm
+
+
+async def _drive(base_url, args):
+    import httpx
+
+    rng = random.Random(args.seed)
+    endpoints = rng.choices(list(WORKLOAD), weights=list(WORKLOAD.values()), k=args.requests)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = {endpoint: [] for endpoint in WORKLOAD}
+    latencies["chat_stream.first_byte"] = []
+    errors = {endpoint: 0 for endpoint in WORKLOAD}
+
+    async def one(client, i, endpoint):
+        user = f"user{rng.randrange(args.users)}@example.com"
+        ticker = f"TICK{rng.randrange(args.tickers)}"
+        async with semaphore:
+            started = time.perf_counter()
+            if endpoint == "chat":
+                response = await client.post("/financial_bot/v1/chat", params={"message": f"How is {ticker} doing?", "stock_name": ticker})
+            elif endpoint == "chat_stream":
+                async with client.stream("POST", "/financial_bot/v1/chat/stream",
+                                         params={"message": f"How is {ticker} doing?", "stock_name": ticker}) as response:
+                    first_byte = None
+                    async for _ in response.aiter_bytes():
+                        first_byte = first_byte or time.perf_counter() - started
+                latencies["chat_stream.first_byte"].append(first_byte or 0.0)
+            elif endpoint == "get_user_preference":
+                response = await client.get("/financial_bot/v1/get_user_preference", params={"email_id": user})
+            elif endpoint == "add_user_preference":
+                response = await client.post("/financial_bot/v1/add_user_preference",
+                                             params={"email_id": user, "preference": json.dumps({"topics": [TOPICS[i % len(TOPICS)]]})})
+            else:
+                response = await client.get("/financial_bot/v1/get_latest_news_snippets", params={"topic": TOPICS[i % len(TOPICS)]})
+            latencies[endpoint].append(time.perf_counter() - started)
+            errors[endpoint] += response.status_code >= 500
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[one(client, i, endpoint) for i, endpoint in enumerate(endpoints)])
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def _latency_stage(timings, elapsed):
+    timings = sorted(timings)
+    return {
+        "count": len(timings),
+        "throughput_per_s": round(len(timings) / elapsed, 3),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 3),
+        "p50_ms": round(timings[len(timings) // 2] * 1000, 3),
+        "p95_ms": round(timings[int(len(timings) * 0.95)] * 1000, 3),
+    }
+
+
+def run_replay(args):
+    """
+    Send a mixed load of args.requests requests to the chat API backed by stand-ins.
+
+    Returns:
+        dict: Report with the run's config and a throughput and latency entry per endpoint
+    """
+    app, llm = load_app(args)
+    with serve(app) as base_url:
+        latencies, errors, elapsed = asyncio.run(_drive(base_url, args))
+
+    stages = {"total": _latency_stage([t for endpoint in WORKLOAD for t in latencies[endpoint]], elapsed)}
+    stages["total"]["errors"] = sum(errors.values())
+    for endpoint, timings in latencies.items():
+        if timings:
+            stages[endpoint] = _latency_stage(timings, elapsed)
+            if endpoint in errors:
+                stages[endpoint]["errors"] = errors[endpoint]
+    stages["total"].update(llm_calls=llm.calls, scrapes=FakeFirecrawlApp.calls)
+    config = {name: getattr(args, name) for name in ("requests", "concurrency", "users", "articles", "tickers", "llm_latency",
+                                                     "scrape_latency", "vector_latency", "mongo_latency",
+                                                     "preference_cache_ttl", "seed")}
+    return {"config": config, "stages": stages}
+
+
+def print_report(report):
+    print(f"{'endpoint':<26} {'requests':>9} {'req/s':>9} {'mean_ms':>9} {'p50_ms':>9} {'p95_ms':>9} {'errors':>7}")
+    for stage, metrics in report["stages"].items():
+        print(f"{stage:<26} {metrics['count']:>9} {metrics['throughput_per_s']:>9} {metrics['mean_ms']:>9} "
+              f"{metrics['p50_ms']:>9} {metrics['p95_ms']:>9} {metrics.get('errors', ''):>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a mixed request load against the chat API with stubbed backends")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--articles", type=int, default=2000)
+    parser.add_argument("--tickers", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--scrape-latency", type=float, default=0.3)
+    parser.add_argument("--vector-latency", type=float, default=0.05)
+    parser.add_argument("--mongo-latency", type=float, default=0.005)
+    parser.add_argument("--preference-cache-ttl", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", help="Write the report as JSON to this path")
+    parser.add_argument("--save-baseline", help="Write the report as the baseline to this path")
+    parser.add_argument("--baseline", help="Compare against the baseline at this path, exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = run_replay(args)
+    print_report(report)
+    for path in (args.report, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} at {args.tolerance:.0%} tolerance")
@@ -0,0 +1,67 @@
+import os
+
+from informatica_shared.resources import resource
+
+
+# Pool sizes per gunicorn worker
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 100))
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 100))
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", 120))
+ZILLIZ_URL = "https://in03-e5bab4e640f79fb.serverless.gcp-us-west1.cloud.zilliz.com"
+ZILLIZ_TOKEN = os.environ.get("ZILLIZ_TOKEN")
+ZILLIZ_COLLECTION = os.environ.get("ZILLIZ_COLLECTION", "informatica_news_items")
+#"milvus" searches Zilliz, "local" the in-process index the subscriber keeps in sync
+RETRIEVAL_BACKEND = os.environ.get("RETRIEVAL_BACKEND", "milvus").lower()
+
+#Client libraries are imported by the factories, on the first request that needs each client
+
+
+def create_openai():
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+    return AsyncOpenAI(
+        timeout=OPENAI_TIMEOUT,
+        http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                                                                max_keepalive_connections=OPENAI_MAX_CONNECTIONS))
+    )
+
+
+def create_mongo():
+    from certifi import where
+    from pymongo import AsyncMongoClient
+    return AsyncMongoClient(os.environ["MONGO_URI"], tlsCAFile=where(), maxPoolSize=MONGO_MAX_POOL_SIZE)
+
+
+def create_firecrawl():
+    from firecrawl import FirecrawlApp
+    return FirecrawlApp(api_key=os.environ["FIRECRAWL_KEY"])
+
+
+def create_embeddings():
+    from langchain_openai import OpenAIEmbeddings
+    from informatica_shared.embedding_cache import CachedEmbeddings
+    #Repeated chat queries reuse the cached query embedding
+    return CachedEmbeddings(OpenAIEmbeddings())
+
+
+def create_vector_store(backend=RETRIEVAL_BACKEND):
+    if backend == "local":
+        from informatica_shared.local_index import LocalVectorIndex
+        return LocalVectorIndex(embedding_function=embeddings.get())
+    if backend != "milvus":
+        raise ValueError(f"Unknown retrieval backend {backend}")
+    from langchain_milvus import Milvus
+    return Milvus(embedding_function=embeddings.get(), connection_args={"uri": ZILLIZ_URL, "token": ZILLIZ_TOKEN}, auto_id=True, collection_name=ZILLIZ_COLLECTION)
+
+
+#One pooled OpenAI client for the chat completions and the news summaries
+openai_client = resource("openai", create_openai, health_check=lambda client: not client.is_closed())
+#AsyncMongoClient reconnects on its own, and a ping can't be awaited from get
+mongo = resource("mongo", create_mongo)
+firecrawl = resource("firecrawl", create_firecrawl)
+embeddings = resource("embeddings", create_embeddings)
+vector_store = resource("vector_store", create_vector_store, requires=(embeddings,))
+
+
+def database():
+    return mongo.get()["informatica_ai"]
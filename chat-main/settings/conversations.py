@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+import secrets
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from informatica_shared.tokens import count_tokens
+
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_TOKEN_BUDGET = int(os.environ.get("CONVERSATION_TOKEN_BUDGET", 2000))
+CONVERSATION_CACHE_SIZE = int(os.environ.get("CONVERSATION_CACHE_SIZE", 1000))
+CONVERSATION_TTL_DAYS = int(os.environ.get("CONVERSATION_TTL_DAYS", 30))
+
+
+async def count_tokens_async(*texts):
+    # Encoding a long history takes milliseconds, count off the event loop
+    return await asyncio.to_thread(lambda: [count_tokens(text) for text in texts])
+
+
+def new_session_id():
+    # Unguessable, holding the id is what gives access to the conversation
+    return secrets.token_urlsafe(32)
+
+
+def format_turn(turn):
+    # Same shape the client side history used
+    return str({turn["user"]: turn["assistant"]})
+
+
+class ConversationStore:
+    """
+    Session-keyed conversation history kept in Mongo with an in-memory LRU in front.
+
+    Each session keeps its recent turns verbatim and a rolling summary of older ones. When
+    the history goes over token_budget, the oldest turns are folded into the summary with
+    summarize, or dropped if summarizing fails. Writes use a version number so a worker
+    with a stale cached copy reloads instead of overwriting newer turns.
+    """
+
+    def __init__(self, collection, summarize=None, token_budget=CONVERSATION_TOKEN_BUDGET,
+                 cache_size=CONVERSATION_CACHE_SIZE):
+        self.collection = collection
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    async def ensure_indexes(self, ttl_days=CONVERSATION_TTL_DAYS):
+        await self.collection.create_index("updated_at", expireAfterSeconds=ttl_days * 86400)
+
+    def _remember(self, conversation):
+        self.cache[conversation["_id"]] = conversation
+        self.cache.move_to_end(conversation["_id"])
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def create(self):
+        """A new empty conversation under a server issued session id, stored by its first append."""
+        return {"_id": new_session_id(), "summary": "", "turns": [], "full_history_tokens": 0, "version": 0}
+
+    async def load(self, session_id, refresh=False):
+        """The stored conversation, or None for a session id this service never issued or that expired."""
+        if not refresh and session_id in self.cache:
+            self.cache.move_to_end(session_id)
+            return self.cache[session_id]
+        conversation = await self.collection.find_one({"_id": session_id})
+        if conversation is not None:
+            self._remember(conversation)
+        return conversation
+
+    def prompt_history(self, conversation):
+        """History text for the prompt, newest turn first like the client side history."""
+        history = "".join(format_turn(turn) for turn in conversation["turns"][::-1])
+        if conversation["summary"]:
+            history += f" Summary of the earlier conversation - {conversation['summary']}"
+        return history
+
+    async def prompt_tokens_saved(self, conversation):
+        """Tokens the full client side history would have added to the prompt beyond ours."""
+        prompt_tokens, = await count_tokens_async(self.prompt_history(conversation))
+        return max(0, conversation["full_history_tokens"] - prompt_tokens)
+
+    async def _compact(self, conversation):
+        turns = conversation["turns"]
+        # Turns keep their token count, only turns stored before it was kept are counted again
+        uncounted = [turn for turn in turns if "tokens" not in turn]
+        summary_tokens, *counts = await count_tokens_async(conversation["summary"], *map(format_turn, uncounted))
+        for turn, count in zip(uncounted, counts):
+            turn["tokens"] = count
+        tokens = [turn["tokens"] for turn in turns]
+        total = summary_tokens + sum(tokens)
+        fold = 0
+        # Always keep the latest turn verbatim
+        while total > self.token_budget and fold < len(turns) - 1:
+            total -= tokens[fold]
+            fold += 1
+        if not fold:
+            return
+        folded = turns[:fold]
+        conversation["turns"] = turns[fold:]
+        if self.summarize is not None:
+            try:
+                conversation["summary"] = await self.summarize(conversation["summary"], [format_turn(turn) for turn in folded])
+                return
+            except Exception as e:
+                logger.error(f"Error summarizing conversation {conversation['_id']}, truncating instead: {str(e)}")
+        # Without a summary the folded turns are simply dropped, keep the old summary within budget
+        summary_tokens, = await count_tokens_async(conversation["summary"])
+        if summary_tokens > self.token_budget // 4:
+            conversation["summary"] = conversation["summary"][-(self.token_budget // 4) * 4:]
+
+    async def append(self, conversation, message, response):
+        """
+        Add a turn to a conversation from create or load and persist it.
+
+        Returns:
+            dict: The updated conversation
+        """
+        session_id = conversation["_id"]
+        for attempt in range(3):
+            if attempt:
+                conversation = await self.load(session_id, refresh=True)
+                if conversation is None:
+                    raise RuntimeError(f"Conversation {session_id} expired while appending a turn")
+            conversation = dict(conversation)
+            turn = {"user": message, "assistant": response}
+            turn["tokens"], = await count_tokens_async(format_turn(turn))
+            conversation["turns"] = [dict(previous) for previous in conversation["turns"]] + [turn]
+            conversation["full_history_tokens"] += turn["tokens"]
+            await self._compact(conversation)
+            version = conversation["version"]
+            conversation["version"] = version + 1
+            conversation["updated_at"] = datetime.now(timezone.utc)
+            update = {key: value for key, value in conversation.items() if key != "_id"}
+            from pymongo.errors import DuplicateKeyError
+            try:
+                result = await self.collection.update_one({"_id": session_id, "version": version}, {"$set": update}, upsert=True)
+            except DuplicateKeyError:
+                # Upsert hit the _id of a newer version written by another worker
+                result = None
+            if result is not None and (result.matched_count or result.upserted_id is not None):
+                self._remember(conversation)
+                return conversation
+        raise RuntimeError(f"Conversation {session_id} kept changing while appending a turn")
@@ -1,61 +1,137 @@
+import asyncio
+import hashlib
 import logging
 import json
-from firecrawl import FirecrawlApp
 import os
-from openai import OpenAI
-from langchain_milvus import Milvus
-from langchain_openai import OpenAIEmbeddings
+import time
+from settings.cache import TTLCache
+from settings.clients import RETRIEVAL_BACKEND, embeddings, firecrawl, openai_client, vector_store
+from informatica_shared.llm_json import parse_llm_json
+from informatica_shared.instrumentation import record_llm_usage, span
 
 
 logger = logging.getLogger(__name__)
-firecrawl_key = os.environ["FIRECRAWL_KEY"]
-crawl_app = FirecrawlApp(api_key=firecrawl_key)
-openai_client = OpenAI()
-ZILLIZ_URL = "https://in03-e5bab4e640f79fb.serverless.gcp-us-west1.cloud.zilliz.com"
-ZILLIZ_TOKEN = os.environ.get("ZILLIZ_TOKEN")
-vector_store = Milvus(embedding_function=OpenAIEmbeddings(), connection_args={"uri": ZILLIZ_URL, "token": ZILLIZ_TOKEN}, auto_id=True, collection_name="informatica_all_news")
+RETRIEVAL_K = int(os.environ.get("RETRIEVAL_K", 5))
+
+# Popular tickers are asked about many times within minutes
+NEWS_SCRAPE_TTL = float(os.environ.get("NEWS_SCRAPE_TTL", 300))
+NEWS_SUMMARY_TTL = float(os.environ.get("NEWS_SUMMARY_TTL", 3600))
+news_cache = TTLCache(maxsize=1000, ttl=NEWS_SCRAPE_TTL)
+summary_cache = TTLCache(maxsize=10000, ttl=NEWS_SUMMARY_TTL)
+_in_flight = {}
 
 def json_cleaner(data):
     """
-    Cleans data to make it JSON-compatible by removing unnecessary whitespaces and ensuring proper quotation marks.
+    Parses model output as JSON, repairing fences, quotes and commas on the way.
     :param data: Input data as a string
-    :return: JSON-compatible data or original string if parsing fails
+    :return: Parsed JSON, or the text with whitespace collapsed if it isn't JSON
+    """
+    parsed = parse_llm_json(data)
+    if parsed is not None:
+        return parsed
+    return " ".join(str(data).replace("\\", "").split())
+
+class StreamCleaner:
+    """
+    Incremental json_cleaner for streamed completions.
+
+    Each fed delta is cleaned on its own, collapsing whitespace runs across delta
+    boundaries and dropping backslashes, so the text can be forwarded as it arrives.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.pending_space = False
+
+    def feed(self, delta):
+        """Clean a delta and return the text to forward, possibly empty."""
+        delta = delta.replace("\\", "")
+        words = delta.split()
+        if not words:
+            self.pending_space = self.pending_space or (bool(delta) and bool(self.parts))
+            return ""
+        leading = " " if self.parts and (self.pending_space or delta[0].isspace()) else ""
+        self.pending_space = delta[-1].isspace()
+        text = leading + " ".join(words)
+        self.parts.append(text)
+        return text
+
+    def result(self):
+        """The whole cleaned response, parsed when it is JSON like json_cleaner does."""
+        data = "".join(self.parts)
+        return parse_llm_json(data, default=data)
+
+async def _single_flight(key, fetch):
+    """Await fetch() once for all concurrent callers asking for the same key."""
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch())
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    # A cancelled caller must not cancel the fetch the others are waiting on
+    return await asyncio.shield(task)
+
+async def get_news_context(stock_name:str=None):
+    """
+    Latest Yahoo Finance news for a ticker, scraped at most once per NEWS_SCRAPE_TTL.
+
+    :return: (news version, news) where the version is a hash of the scraped news
+    """
+    key = stock_name or ""
+    cached = news_cache.get(key)
+    if cached is not None:
+        return cached
+
+    async def fetch():
+        news = await asyncio.to_thread(get_latest_news_yahoo, stock_name)
+        context = (hashlib.sha256(news.encode("utf-8")).hexdigest()[:16], news)
+        if news:
+            news_cache.set(key, context)
+        return context
+
+    return await _single_flight(("news", key), fetch)
+
+async def news_summarizer(query:str,stock_name:str=None):
+    """
+    Summary of the latest news and stored articles relevant to the query.
+
+    Summaries are cached per query, ticker and news version, so they are reused until the
+    ticker's news changes. On a miss the scrape and the vector search run concurrently.
     """
     try:
-        # Convert data to a string if not already
-        data = str(data)
-
-        # Remove extra newlines and whitespace
-        data = " ".join(data.split())
-
-        # Ensure JSON-friendly quotes
-        data = data.replace("\n", " ")
-        data = data.replace("\r", " ")
-        data = data.replace("  ", " ")
-        data = data.replace("\\", "")
-
-        # Attempt to parse and load as JSON
-        return json.loads(data)
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON decoding error: {str(e)}")
-        return data  # Return the original data if parsing fails
+        query_hash = hashlib.sha256(" ".join(query.lower().split()).encode("utf-8")).hexdigest()
+        cached_news = news_cache.get(stock_name or "")
+        if cached_news is not None:
+            version, news = cached_news
+            summary = summary_cache.get((query_hash, stock_name, version))
+            if summary is not None:
+                return summary
+            data = await asyncio.to_thread(get_data_from_milvus, query)
+        else:
+            (version, news), data = await asyncio.gather(get_news_context(stock_name), asyncio.to_thread(get_data_from_milvus, query))
+            summary = summary_cache.get((query_hash, stock_name, version))
+            if summary is not None:
+                return summary
+
+        async def summarize():
+            started = time.perf_counter()
+            response = await openai_client.get().chat.completions.create(
+                model='gpt-4o',
+                messages=[
+                    {'role': 'system', 'content': f'You are a news extractor & summarizer, who is provided with information from multiple news sources & Database, extract relevant information around {query} from news, and summarize in 1-2 paragraphs'},
+                    {'role': 'user', 'content': f'News Headlines {news}'},
+                    {'role':'user','content': f'Data from Database {data}'}
+                ]
+            )
+            record_llm_usage("gpt-4o", "news_summary", time.perf_counter() - started, getattr(response, "usage", None))
+            summary = json_cleaner(response.choices[0].message.content)
+            summary_cache.set((query_hash, stock_name, version), summary)
+            return summary
+
+        return await _single_flight(("summary", query_hash, stock_name, version), summarize)
     except Exception as e:
-        logger.error(f"Error in cleaning data: {str(e)}")
-        return data
-
-def news_summarizer(query:str,stock_name:str=None):
-    news = get_latest_news_yahoo(stock_name)
-    data = get_data_from_milvus(query)
-
-    response = openai_client.chat.completions.create(
-        model='gpt-4o',
-        messages=[
-            {'role': 'system', 'content': f'You are a news extractor & summarizer, who is provided with information from multiple news sources & Database, extract relevant information around {query} from news, and summarize in 1-2 paragraphs'},
-            {'role': 'user', 'content': f'News Headlines {news}'},
-            {'role':'user','content': f'Data from Database {data}'}
-        ]
-    )
-    return json_cleaner(response.choices[0].message.content)
+        logger.error(f"Error in summarizing news: {str(e)}")
+        return ""
 
 def get_latest_news_yahoo(stock_name:str=None):
     if stock_name is None:
@@ -64,21 +140,35 @@ def get_latest_news_yahoo(stock_name:str=None):
         url = f"https://finance.yahoo.com/quote/{stock_name}"
 
     try:
-        scrape_result = crawl_app.scrape_url(url, params={'formats': ['markdown']})
+        with span("scrape", url=url):
+            scrape_result = firecrawl.get().scrape_url(url, params={'formats': ['markdown']})
         return str(scrape_result)
     except Exception as e:
         logger.error(f"Error in getting latest news yahoo: {str(e)}")
         return ""
 
-def get_data_from_milvus(query:str=None):
+def get_data_from_milvus(query:str=None, topics:list=None, since=None):
+    """
+    Stored articles most relevant to the query, from the configured retrieval backend.
+
+    :param topics: Only return articles with one of these topics
+    :param since: Only return articles ingested after this time, local backend only
+    """
     try:
         if query is None:
             return ""
 
-        data = vector_store.similarity_search(query, top_k=5)
+        with span("vector_search", backend=RETRIEVAL_BACKEND):
+            store = vector_store.get()
+            if RETRIEVAL_BACKEND == "local":
+                data = store.similarity_search(query, k=RETRIEVAL_K, topics=topics, since=since)
+            elif topics:
+                data = store.similarity_search(query, k=RETRIEVAL_K, expr=f"topic in {json.dumps(list(topics))}")
+            else:
+                data = store.similarity_search(query, k=RETRIEVAL_K)
+        if embeddings.peek() is not None:
+            logger.debug(f"Embedding cache {embeddings.peek().stats()}")
         return str(data)
     except Exception as e:
         logger.error(f"Error in getting data from Milvus: {str(e)}")
         return ""
-
-
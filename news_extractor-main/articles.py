@@ -0,0 +1,100 @@
+import hashlib
+from datetime import datetime, timezone
+
+from ingest import NEWS_ITEM_FIELDS
+
+
+def ensure_indexes(collection):
+    """Indexes for topic and source range scans over recent articles."""
+    from pymongo import ASCENDING, DESCENDING
+    collection.create_index([("topic", ASCENDING), ("ingested_at", DESCENDING)])
+    collection.create_index([("source", ASCENDING), ("ingested_at", DESCENDING)])
+    collection.create_index([("ingested_at", DESCENDING)])
+    collection.create_index("cycle_id")
+
+
+def message_cycle_id(envelope):
+    """
+    Cycle id of a queue message, the same on every delivery of the message.
+
+    A publish is its url and scrape time, so the same page published again, unchanged,
+    is a new cycle and dedup drops its articles. Messages from before the envelope format
+    carry neither and fall back to their content hash.
+    """
+    if envelope["fetched_at"]:
+        key = f"{envelope['url']}\0{envelope['fetched_at']}"
+    else:
+        key = f"{envelope['url']}\0{envelope['content_hash']}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def replace_cycle(collection, cycle_id, articles):
+    """Store the articles of a cycle, replacing any stored by an earlier attempt at it."""
+    collection.delete_many({"cycle_id": cycle_id})
+    if articles:
+        collection.insert_many(articles, ordered=False)
+
+
+def news_articles(summaries, cycle_id, ingested_at=None, fetched_at=None):
+    """
+    Flatten the summarizer output into one document per article.
+
+    Args:
+        summaries: dict of news source -> list of news items
+        cycle_id: Id shared by every article from the same summarized message
+        ingested_at: Time the articles are stored, defaults to now
+        fetched_at: Time the source page was scraped, used when an item has no publish time
+
+    Returns:
+        list: Article documents for the all_news collection
+    """
+    ingested_at = ingested_at or datetime.now(timezone.utc)
+    articles = []
+    for source, items in summaries.items():
+        if not isinstance(items, list):
+            continue
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            article = {field: item.get(field) for field in NEWS_ITEM_FIELDS}
+            article.update({
+                "source": source,
+                "published_at": item.get("published_at") or fetched_at,
+                "ingested_at": ingested_at,
+                "cycle_id": cycle_id,
+            })
+            articles.append(article)
+    return articles
+
+
+def migrate_legacy_news(collection, batch_size=100):
+    """
+    Rewrite legacy {source: [items]} documents into per-article documents.
+
+    Each legacy document becomes a cycle whose id is its ObjectId and whose ingested_at is
+    the ObjectId creation time. Safe to run again after an interruption, since articles of
+    a partially migrated document are replaced.
+
+    Returns:
+        int: Number of legacy documents migrated
+    """
+    migrated = 0
+    legacy_query = {"cycle_id": {"$exists": False}}
+    while True:
+        legacy = list(collection.find(legacy_query).limit(batch_size))
+        if not legacy:
+            return migrated
+        for document in legacy:
+            cycle_id = str(document["_id"])
+            summaries = {key: value for key, value in document.items() if key != "_id"}
+            articles = news_articles(summaries, cycle_id, ingested_at=document["_id"].generation_time)
+            replace_cycle(collection, cycle_id, articles)
+            collection.delete_one({"_id": document["_id"]})
+            migrated += 1
+        print(f"Migrated {migrated} legacy news documents")
+
+
+if __name__ == "__main__":
+    from clients import all_news
+    all_news_db = all_news.get()
+    print(f"Migration done, {migrate_legacy_news(all_news_db)} legacy news documents migrated")
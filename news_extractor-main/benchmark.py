@@ -0,0 +1,537 @@
+import argparse
+import copy
+import hashlib
+import os
+import itertools
+import json
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import openai
+import urllib3
+from informatica_shared.llm_json import parse_llm_json, validate_news_summaries
+
+from consumer import QueueConsumer
+from dispatcher import EmailDispatcher
+from envelope import build_envelope, encode_envelope, split_message
+from ingest import ingest_news
+from newsletter import FragmentCache, NewsletterTemplate, TopicIndex, render_newsletters
+from scraper import scrape_sources
+from summarizer import NewsSummarizer, count_tokens
+
+
+class FakeFirecrawlApp:
+    """Stand-in for FirecrawlApp that sleeps for a fixed round trip instead of calling the API."""
+
+    def __init__(self, latency=0.5, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+    def scrape_url(self, url, params=None):
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise RuntimeError(f"Fake scrape failure for {url}")
+        return {"markdown": f"# Latest news from {url}\n" + "Headline text. " * 200, "metadata": {"sourceURL": url}}
+
+
+class InMemoryMessage:
+    def __init__(self, content):
+        self.id = str(uuid.uuid4())
+        self.content = content
+        self.inserted_on = datetime.now(timezone.utc)
+        self.dequeue_count = 0
+        self.pop_receipt = None
+        self.visible_at = 0.0
+
+
+class InMemoryQueue:
+    """Stand-in for the Azure QueueClient with visibility timeouts and pop receipts."""
+
+    def __init__(self):
+        self.messages = {}
+        self._lock = threading.Lock()
+
+    def send_message(self, content):
+        message = InMemoryMessage(content)
+        with self._lock:
+            self.messages[message.id] = message
+        return message
+
+    def receive_messages(self, messages_per_page=None, max_messages=None, visibility_timeout=30):
+        now = time.time()
+        received = []
+        with self._lock:
+            for message in self.messages.values():
+                if len(received) == (max_messages or 32):
+                    break
+                if message.visible_at <= now:
+                    message.visible_at = now + visibility_timeout
+                    message.dequeue_count += 1
+                    message.pop_receipt = str(uuid.uuid4())
+                    received.append(message)
+        return iter(received)
+
+    def delete_message(self, message):
+        with self._lock:
+            stored = self.messages.get(message.id)
+            if stored is None or stored.pop_receipt != message.pop_receipt:
+                raise KeyError(f"Message {message.id} not found or receipt expired")
+            del self.messages[message.id]
+
+
+class FakeEmbeddings:
+    """Deterministic embeddings derived from a hash of the text, with a fixed latency per request."""
+
+    def __init__(self, dimensions=64, latency=0.05):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.requests = 0
+        self.texts = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [digest[i % len(digest)] / 255 for i in range(self.dimensions)]
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.requests += 1
+            self.texts += len(texts)
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class InMemoryVectorStore:
+    """Stand-in for the Milvus vector store that counts insert round trips, each taking latency seconds."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.rows = []
+        self.inserts = 0
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, batch_size=1000):
+        metadatas = metadatas or [{} for _ in texts]
+        for i in range(0, len(texts), batch_size):
+            time.sleep(self.latency)
+            self.inserts += 1
+            self.rows.extend(zip(texts[i:i + batch_size], embeddings[i:i + batch_size], metadatas[i:i + batch_size]))
+        return list(range(len(self.rows) - len(texts), len(self.rows)))
+
+
+class NovuStub:
+    """
+    Local HTTP server answering Novu trigger and bulk trigger requests.
+
+    Each request sleeps for latency seconds, and failure_rate of them get a 429 or 500.
+    """
+
+    def __init__(self, latency=0.05, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.recipients = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                time.sleep(stub.latency)
+                if random.random() < stub.failure_rate:
+                    self._reply(random.choice([429, 500]), {"message": "try again"})
+                    return
+                events = body["events"] if self.path.endswith("/bulk") else [body]
+                with stub._lock:
+                    stub.requests += 1
+                    stub.recipients += sum(len(event["to"]) if isinstance(event["to"], list) else 1 for event in events)
+                self._reply(201, {"data": [{"acknowledged": True, "status": "processed"} for _ in events]})
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeOpenAI:
+    """
+    Stand-in for the OpenAI client's chat completions.
+
+    Every '## ' headline in the prompt becomes a news item, with a topic picked from a hash
+    of the headline. A call takes latency seconds plus item_latency per item written, like a
+    model bound by output tokens. Prompts over context_tokens fail, and rate_limit_rate of
+    the calls get a 429.
+    """
+
+    def __init__(self, latency=0.5, item_latency=0.05, rate_limit_rate=0.0, context_tokens=128000):
+        self.latency = latency
+        self.item_latency = item_latency
+        self.rate_limit_rate = rate_limit_rate
+        self.context_tokens = context_tokens
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.chat = self
+        self.completions = self
+
+    def create(self, model, messages, **kwargs):
+        with self._lock:
+            self.calls += 1
+        content = messages[-1]["content"]
+        request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+        if random.random() < self.rate_limit_rate:
+            raise openai.RateLimitError("Rate limit reached", response=httpx.Response(429, request=request), body=None)
+        if count_tokens(content) > self.context_tokens:
+            raise openai.BadRequestError("Context length exceeded", response=httpx.Response(400, request=request), body=None)
+        items = []
+        for line in content.splitlines():
+            if line.startswith("## "):
+                digest = hashlib.md5(line.encode()).hexdigest()
+                items.append({"title": line[3:].strip(), "summary": f"Summary of {line[3:].strip()}",
+                              "link": f"https://news.example.com/{digest[:8]}",
+                              "topic": NEWSLETTER_TOPICS[int(digest[8:16], 16) % len(NEWSLETTER_TOPICS)]})
+        time.sleep(self.latency + self.item_latency * len(items))
+        message = type("Message", (), {"content": json.dumps({"Yahoo News": items})})
+        return type("Completion", (), {"choices": [type("Choice", (), {"message": message})]})
+
+
+def fake_news_page(headline_count, words_per_story=200):
+    return "\n\n".join(f"## Headline {i}\n" + " ".join(f"word{(i * j) % 997}" for j in range(words_per_story))
+                       for i in range(headline_count))
+
+
+def fake_news_summaries(item_count, sources=("Yahoo News", "Google Finance")):
+    topics = ["Technology", "Energy", "Healthcare", "Financial Services", "Real Estate"]
+    return {
+        source: [{
+            "title": f"{source} headline {i}",
+            "summary": f"Summary of story {i} from {source}, markets moved on the news.",
+            "link": f"https://news.example.com/{i}",
+            "topic": topics[i % len(topics)],
+        } for i in range(item_count // len(sources))]
+        for source in sources
+    }
+
+
+def bench_scrape(source_counts, latency, failure_rate, concurrency):
+    crawl_app = FakeFirecrawlApp(latency=latency, failure_rate=failure_rate)
+
+    def extract_news(url):
+        return str(crawl_app.scrape_url(url, params={'formats': ['markdown']}))
+
+    print(f"{'sources':>8} {'sequential_s':>13} {'concurrent_s':>13} {'scraped':>8}")
+    for count in source_counts:
+        urls = [f"https://news-{i}.example.com" for i in range(count)]
+
+        started = time.perf_counter()
+        for url in urls:
+            try:
+                extract_news(url)
+            except Exception:
+                pass
+        sequential = time.perf_counter() - started
+
+        started = time.perf_counter()
+        scraped = scrape_sources(urls, extract_news, concurrency=concurrency, timeout=latency * 4, retries=1, backoff=0.05)
+        concurrent = time.perf_counter() - started
+
+        print(f"{count:>8} {sequential:>13.2f} {concurrent:>13.2f} {len(scraped):>8}")
+
+
+def bench_consumer(message_count, workers, batch_size, process_latency, failure_rate):
+    queue = InMemoryQueue()
+    for i in range(message_count):
+        payload = encode_envelope(build_envelope(f"https://news-{i}.example.com", "Headline text. " * 2000))
+        for message in split_message(payload):
+            queue.send_message(message)
+    attempts = itertools.count()
+
+    def process(payload):
+        next(attempts)
+        time.sleep(process_latency)
+        if random.random() < failure_rate:
+            raise RuntimeError("Fake write failure")
+
+    consumer = QueueConsumer(queue, process, batch_size=batch_size, visibility_timeout=1, workers=workers,
+                             min_poll_interval=0.01, max_poll_interval=0.25)
+    started = time.perf_counter()
+    metrics = consumer.run(max_idle_polls=8)
+    elapsed = time.perf_counter() - started
+    print(f"Consumed {message_count} payloads in {elapsed:.2f}s with {next(attempts)} attempts, {len(queue.messages)} left on the queue")
+    print(metrics)
+
+
+def bench_ingest(item_count, batch_size, concurrency, embedding_latency):
+    summaries = fake_news_summaries(item_count)
+    # The old path passed str(summaries) to add_texts, embedding one character per vector
+    legacy_vectors = len(str(summaries))
+
+    embedding = FakeEmbeddings(latency=embedding_latency)
+    store = InMemoryVectorStore()
+    started = time.perf_counter()
+    inserted = ingest_news(summaries, store, embedding, batch_size=batch_size, concurrency=concurrency)
+    elapsed = time.perf_counter() - started
+    print(f"Ingested {inserted} news items in {elapsed:.2f}s: {embedding.requests} embedding requests, "
+          f"{store.inserts} vector store inserts, {len(store.rows)} vectors (legacy path: {legacy_vectors} vectors)")
+
+
+def legacy_clean_json(data):
+    # The subscriber's clean_json before the tolerant parser, kept for comparison
+    try:
+        data = str(data)
+        data = " ".join(data.split())
+        data = data.replace("\\", "")
+        data = data.replace("```", "")
+        data = data.replace("json", "")
+        data = data.replace("https://", "")
+        data = data.replace("https:", "")
+        return json.loads(data)
+    except Exception:
+        return data
+
+
+def bench_parser(corpus_path, repeat):
+    with open(corpus_path) as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+
+    def new_parser(output):
+        return validate_news_summaries(parse_llm_json(output, allow_prose=True))
+
+    for name, parse in (("legacy", legacy_clean_json), ("tolerant", new_parser)):
+        parsed = 0
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for case in cases:
+                result = parse(case["output"])
+                items = sum(len(items) for items in result.values() if isinstance(items, list)) if isinstance(result, dict) else 0
+                parsed += items == case["expected_items"]
+        elapsed = time.perf_counter() - started
+        documents = repeat * len(cases)
+        print(f"{name} parser: {parsed / documents:.0%} of {len(cases)} recorded outputs parsed, "
+              f"{elapsed / documents * 1e6:.1f}us per document")
+
+
+NEWSLETTER_TOPICS = ["Minerals", "Technology", "Real Estate", "Politics", "Healthcare", "Energy", "Consumer Goods",
+                     "Financial Services", "Telecommunications", "Utilities", "Electronics"]
+
+
+def legacy_newsletter_renderer(template_html):
+    # The notifier's renderer before the compiled template, kept for comparison
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(template_html, "html.parser")
+    article_template = soup.find('div', class_='columns')
+    article_str = str(article_template)
+    html_start = str(soup).split(article_str, 1)[0].replace('\n', '')
+    html_end = str(soup).split(article_str, 1)[1].replace('\n', '')
+
+    def prepare_news_letter(news):
+        html = html_start
+        for news_item in news:
+            article = copy.deepcopy(article_template)
+            if article.find('h1'):
+                article.find('h1').string = news_item["title"]
+            if article.find('p'):
+                article.find('p').string = news_item["summary"]
+            if article.find('a'):
+                article.find('a')['href'] = news_item["link"]
+                article.find('a').string = f"Read More on {news_item['source']}"
+            if article.find('img'):
+                article.find('img')['src'] = f"https://picsum.photos/seed/{news_item['title']}/800/400"
+            html += str(article)
+        return html + html_end
+
+    return prepare_news_letter
+
+
+def bench_newsletter(user_count, article_count, legacy_sample):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "email_template.html")) as f:
+        template_html = f.read()
+    articles = [{
+        "title": f"Headline {i}",
+        "summary": f"Summary of story {i}, markets moved on the news.",
+        "link": f"https://news.example.com/{i}",
+        "topic": NEWSLETTER_TOPICS[i % len(NEWSLETTER_TOPICS)],
+        "source": "Yahoo News" if i % 2 else "Google Finance",
+        "cycle_id": str(i % 3),
+    } for i in range(article_count)]
+    rng = random.Random(0)
+    user_topics = {f"user{i}@example.com": rng.sample(NEWSLETTER_TOPICS, rng.randint(1, 3)) for i in range(user_count)}
+
+    # The old path rendered every user's newsletter from scratch, time a sample of them
+    legacy_prepare_news_letter = legacy_newsletter_renderer(template_html)
+    started = time.perf_counter()
+    for user in list(user_topics)[:legacy_sample]:
+        legacy_prepare_news_letter([news for news in articles if news["topic"] in user_topics[user]])
+    legacy_elapsed = (time.perf_counter() - started) / legacy_sample * user_count
+
+    # Matching alone, every user against every article
+    started = time.perf_counter()
+    for user in user_topics:
+        [news for news in articles if news["topic"] in user_topics[user]]
+    legacy_matching = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index = TopicIndex(articles).add_subscribers(user_topics.items())
+    matching = time.perf_counter() - started
+    print(f"Matched {user_count} users to {article_count} articles in {matching:.2f}s with the topic index "
+          f"(legacy path: {legacy_matching:.2f}s)")
+
+    started = time.perf_counter()
+    template = NewsletterTemplate(template_html)
+    fragment_cache = FragmentCache(template)
+    fragments = fragment_cache.render(articles)
+    newsletters = delivered = 0
+    for users, _ in render_newsletters(template, index, fragments):
+        newsletters += 1
+        delivered += len(users)
+    elapsed = time.perf_counter() - started
+    print(f"Rendered newsletters for {delivered} of {user_count} users in {elapsed:.2f}s: {newsletters} distinct "
+          f"newsletters, {fragment_cache.rendered} article fragments (legacy path: ~{legacy_elapsed:.0f}s "
+          f"extrapolated from {legacy_sample} users)")
+
+
+def bench_dispatch(user_count, newsletter_count, latency, failure_rate, concurrency, rate_limit, legacy_sample):
+    stub = NovuStub(latency=latency, failure_rate=failure_rate)
+    content_html = "<html>" + "news " * 5000 + "</html>"
+    users = [f"user{i}@example.com" for i in range(user_count)]
+    newsletters = [(users[i::newsletter_count], content_html) for i in range(newsletter_count)]
+
+    # The old path made a new pool and one trigger request per recipient, in sequence
+    started = time.perf_counter()
+    for user in users[:legacy_sample]:
+        http = urllib3.PoolManager()
+        http.request('POST', stub.url + "/v1/events/trigger", headers={'Content-Type': 'application/json'},
+                     body=json.dumps({"name": "emailerworkflow", "to": {"subscriberId": str(uuid.uuid4()), "email": user},
+                                      "payload": {'Message': content_html}}).encode('utf-8'))
+    legacy_elapsed = (time.perf_counter() - started) / legacy_sample * user_count
+
+    stub.requests = stub.recipients = 0
+    dispatcher = EmailDispatcher("bench", api_url=stub.url, concurrency=concurrency, rate_limit=rate_limit, backoff=0.05)
+    metrics = dispatcher.send(newsletters)
+    stub.close()
+    print(f"Dispatched {user_count} recipients in {metrics['elapsed_s']:.2f}s with {stub.requests} accepted requests: "
+          f"{metrics} (legacy path: ~{legacy_elapsed:.0f}s extrapolated from {legacy_sample} recipients)")
+
+
+def bench_summarize(headline_counts, latency, item_latency, rate_limit_rate, chunk_tokens, concurrency):
+    for headline_count in headline_counts:
+        page = fake_news_page(headline_count)
+        client = FakeOpenAI(latency=latency, item_latency=item_latency, rate_limit_rate=rate_limit_rate)
+
+        # The old path sent the whole page in one prompt
+        started = time.perf_counter()
+        try:
+            single = NewsSummarizer(client, chunk_tokens=10 ** 9, concurrency=1, retries=0)
+            legacy = f"{sum(map(len, single.summarize(page, source='https://finance.yahoo.com').values()))} items"
+        except openai.BadRequestError as e:
+            legacy = f"failed ({e.message})"
+        legacy_elapsed = time.perf_counter() - started
+
+        summarizer = NewsSummarizer(client, chunk_tokens=chunk_tokens, concurrency=concurrency, backoff=0.05)
+        started = time.perf_counter()
+        items = sum(map(len, summarizer.summarize(page, source="https://finance.yahoo.com").values()))
+        elapsed = time.perf_counter() - started
+        # Same page with one story changed, only its chunk is summarized again
+        started = time.perf_counter()
+        summarizer.summarize(page.replace("## Headline 0\n", "## Headline 0 updated\n"), source="https://finance.yahoo.com")
+        resummarize_elapsed = time.perf_counter() - started
+        print(f"Summarized a {count_tokens(page)} token page with {headline_count} stories into {items} items in "
+              f"{elapsed:.2f}s, {resummarize_elapsed:.2f}s after a one story change, cache {summarizer.stats()} "
+              f"(single prompt: {legacy} in {legacy_elapsed:.2f}s)")
+
+
+# Read by the client factories, none of them should be needed to import a module
+CREDENTIALS = ("FIRECRAWL_KEY", "AZURE_CONNECTION_STRING", "PROJECT_ID", "PUB_TOPIC_ID", "MONGO_URI", "NOVU_KEY",
+               "OPENAI_API_KEY", "ZILLIZ_TOKEN")
+
+
+def bench_startup(modules, repeat):
+    # A fresh interpreter per run, with no credentials, so nothing is imported or connected before the module
+    env = {name: value for name, value in os.environ.items() if name not in CREDENTIALS}
+    code = "import sys, time; started = time.perf_counter(); __import__(sys.argv[1]); print(time.perf_counter() - started)"
+    for module in modules:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = subprocess.run([sys.executable, "-c", code, module], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    env=env, capture_output=True, text=True)
+            process_elapsed = time.perf_counter() - started
+            if result.returncode:
+                print(f"Importing {module} without credentials failed: {result.stderr.strip().splitlines()[-1]}")
+                break
+            timings.append((float(result.stdout.strip().splitlines()[-1]), process_elapsed))
+        else:
+            print(f"Imported {module} without credentials in {statistics.median(t[0] for t in timings) * 1000:.0f}ms, "
+                  f"{statistics.median(t[1] for t in timings) * 1000:.0f}ms with interpreter startup (median of {repeat})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the news extractor stages against local stand-ins")
+    parser.add_argument("--sources", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--process-latency", type=float, default=0.05)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--embedding-batch-size", type=int, default=64)
+    parser.add_argument("--embedding-concurrency", type=int, default=4)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--llm-outputs", default="fixtures/llm_outputs.jsonl")
+    parser.add_argument("--parser-repeat", type=int, default=1000)
+    parser.add_argument("--newsletter-users", type=int, default=100000)
+    parser.add_argument("--newsletter-articles", type=int, default=60)
+    parser.add_argument("--legacy-newsletter-sample", type=int, default=200)
+    parser.add_argument("--email-users", type=int, default=20000)
+    parser.add_argument("--email-newsletters", type=int, default=231)
+    parser.add_argument("--email-latency", type=float, default=0.05)
+    parser.add_argument("--email-concurrency", type=int, default=8)
+    parser.add_argument("--email-rate-limit", type=float, default=20)
+    parser.add_argument("--page-stories", type=int, nargs="+", default=[20, 100, 400])
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--llm-item-latency", type=float, default=0.05)
+    parser.add_argument("--llm-rate-limit-rate", type=float, default=0.05)
+    parser.add_argument("--summary-chunk-tokens", type=int, default=4000)
+    parser.add_argument("--summary-concurrency", type=int, default=8)
+    parser.add_argument("--startup-modules", nargs="+", default=["main", "subscriber", "notifier"])
+    parser.add_argument("--startup-repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    bench_scrape(args.sources, args.latency, args.failure_rate, args.concurrency)
+    bench_consumer(args.messages, args.workers, args.batch_size, args.process_latency, args.failure_rate)
+    bench_ingest(args.items, args.embedding_batch_size, args.embedding_concurrency, args.embedding_latency)
+    bench_parser(args.llm_outputs, args.parser_repeat)
+    bench_newsletter(args.newsletter_users, args.newsletter_articles, args.legacy_newsletter_sample)
+    bench_dispatch(args.email_users, args.email_newsletters, args.email_latency, args.failure_rate,
+                   args.email_concurrency, args.email_rate_limit, legacy_sample=50)
+    bench_summarize(args.page_stories, args.llm_latency, args.llm_item_latency, args.llm_rate_limit_rate,
+                    args.summary_chunk_tokens, args.summary_concurrency)
+    bench_startup(args.startup_modules, args.startup_repeat)
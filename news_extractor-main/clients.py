@@ -0,0 +1,77 @@
+import os
+
+from informatica_shared.resources import resource
+
+
+azure_queue_name = "raw-to-informatica-queue"
+azure_queue_url = "https://rawtoinformatica.queue.core.windows.net/raw-to-informatica-queue"
+ZILLIZ_URL = "https://in03-e5bab4e640f79fb.serverless.gcp-us-west1.cloud.zilliz.com"
+ZILLIZ_TOKEN = os.environ.get("ZILLIZ_TOKEN")
+#One vector per news item with its metadata, the old collection held one vector per character
+ZILLIZ_COLLECTION = os.environ.get("ZILLIZ_COLLECTION", "informatica_news_items")
+
+#Client libraries are imported by the factories, on the first use of each client
+
+
+def create_firecrawl():
+    from firecrawl import FirecrawlApp
+    return FirecrawlApp(api_key=os.environ["FIRECRAWL_KEY"])
+
+
+def create_pubsub_publisher():
+    from google.cloud import pubsub_v1
+    return pubsub_v1.PublisherClient()
+
+
+def create_azure_queue():
+    from azure.storage.queue import BinaryBase64DecodePolicy, BinaryBase64EncodePolicy, QueueClient
+    return QueueClient.from_connection_string(os.environ["AZURE_CONNECTION_STRING"], azure_queue_name,
+                                              message_encode_policy=BinaryBase64EncodePolicy(),
+                                              message_decode_policy=BinaryBase64DecodePolicy())
+
+
+def create_openai():
+    from openai import OpenAI
+    return OpenAI()
+
+
+def create_mongo():
+    from certifi import where
+    from pymongo import MongoClient
+    return MongoClient(os.environ["MONGO_URI"], tlsCAFile=where())
+
+
+def create_embeddings():
+    from langchain_openai import OpenAIEmbeddings
+    from informatica_shared.embedding_cache import CachedEmbeddings
+    #Headlines repeat across cycles, only embed the ones not seen before
+    return CachedEmbeddings(OpenAIEmbeddings())
+
+
+def create_vector_store():
+    from langchain_milvus import Milvus
+    return Milvus(embedding_function=embeddings.get(), connection_args={"uri": ZILLIZ_URL, "token": ZILLIZ_TOKEN},
+                  auto_id=True, collection_name=ZILLIZ_COLLECTION)
+
+
+def create_all_news():
+    from articles import ensure_indexes
+    collection = database()["all_news"]
+    ensure_indexes(collection)
+    return collection
+
+
+firecrawl = resource("firecrawl", create_firecrawl)
+pubsub_publisher = resource("pubsub_publisher", create_pubsub_publisher)
+azure_queue = resource("azure_queue", create_azure_queue)
+openai_client = resource("openai", create_openai, health_check=lambda client: not client.is_closed())
+mongo = resource("mongo", create_mongo, health_check=lambda client: client.admin.command("ping"),
+                 close=lambda client: client.close())
+embeddings = resource("embeddings", create_embeddings)
+vector_store = resource("vector_store", create_vector_store, requires=(embeddings,))
+#Indexes are created once per process, on first use
+all_news = resource("all_news", create_all_news, requires=(mongo,))
+
+
+def database():
+    return mongo.get()["informatica_ai"]
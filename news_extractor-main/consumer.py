@@ -0,0 +1,180 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from common import percentile
+from envelope import ChunkAssembler
+from informatica_shared.instrumentation import counter, span
+
+
+queue_messages = counter("queue_messages_total", "Queue messages received and how they ended", ("outcome",))
+
+
+QUEUE_BATCH_SIZE = int(os.environ.get("QUEUE_BATCH_SIZE", 16))
+QUEUE_VISIBILITY_TIMEOUT = int(os.environ.get("QUEUE_VISIBILITY_TIMEOUT", 900))
+QUEUE_WORKERS = int(os.environ.get("QUEUE_WORKERS", 4))
+QUEUE_MAX_DEQUEUE_COUNT = int(os.environ.get("QUEUE_MAX_DEQUEUE_COUNT", 5))
+QUEUE_MIN_POLL_INTERVAL = float(os.environ.get("QUEUE_MIN_POLL_INTERVAL", 5))
+QUEUE_MAX_POLL_INTERVAL = float(os.environ.get("QUEUE_MAX_POLL_INTERVAL", 14400))
+
+
+class ConsumerMetrics:
+    """Thread safe throughput, queue lag and per-stage latency for the consumer."""
+
+    def __init__(self, window=1000):
+        self.started = time.time()
+        self.processed = 0
+        self.failed = 0
+        self.lag = deque(maxlen=window)
+        self.latency = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.latency[stage].append(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            with span(name):
+                yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def record_lag(self, inserted_on):
+        if inserted_on is None:
+            return
+        with self._lock:
+            self.lag.append((datetime.now(timezone.utc) - inserted_on).total_seconds())
+
+    def record_result(self, succeeded):
+        with self._lock:
+            if succeeded:
+                self.processed += 1
+            else:
+                self.failed += 1
+        queue_messages.inc(outcome="processed" if succeeded else "failed")
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = time.time() - self.started
+            return {
+                "processed": self.processed,
+                "failed": self.failed,
+                "throughput_per_s": round(self.processed / elapsed, 3) if elapsed else 0.0,
+                "queue_lag_s": {"p50": round(percentile(self.lag, 0.5), 3), "max": round(max(self.lag, default=0.0), 3)},
+                "stage_latency_s": {
+                    stage: {"p50": round(percentile(values, 0.5), 3), "p95": round(percentile(values, 0.95), 3)}
+                    for stage, values in self.latency.items()
+                },
+            }
+
+
+class QueueConsumer:
+    """
+    Batched queue consumer that hands payloads to a worker pool.
+
+    Messages are received in batches of up to one per idle worker and stay invisible for
+    the visibility timeout while they are processed. A message is deleted only after process returns, so a crash or a
+    failed write makes it visible again for a retry. Messages redelivered more than
+    max_dequeue_count times are dropped as poison. Empty polls back off exponentially
+    between min_poll_interval and max_poll_interval.
+    """
+
+    def __init__(self, queue_client, process, batch_size=QUEUE_BATCH_SIZE, visibility_timeout=QUEUE_VISIBILITY_TIMEOUT,
+                 workers=QUEUE_WORKERS, max_dequeue_count=QUEUE_MAX_DEQUEUE_COUNT,
+                 min_poll_interval=QUEUE_MIN_POLL_INTERVAL, max_poll_interval=QUEUE_MAX_POLL_INTERVAL, metrics=None):
+        self.queue_client = queue_client
+        self.process = process
+        # Azure returns at most 32 messages per receive
+        self.batch_size = max(1, min(batch_size, 32))
+        self.visibility_timeout = visibility_timeout
+        self.workers = max(1, workers)
+        self.max_dequeue_count = max_dequeue_count
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.metrics = metrics or ConsumerMetrics()
+        self.chunk_assembler = ChunkAssembler()
+
+    def _delete(self, messages):
+        for message in messages:
+            try:
+                self.queue_client.delete_message(message)
+            except Exception as e:
+                # Visibility ran out while processing, the message will be seen again
+                print(f"Error deleting message {message.id}: {e}")
+
+    def _process(self, payload):
+        with self.metrics.stage("total"):
+            self.process(payload)
+
+    def _receive_batch(self, pool, in_flight):
+        # Only as many messages as there are idle workers, the visibility timeout of a
+        # message waiting behind busy workers would run out and get it processed twice
+        count = min(self.batch_size, self.workers - len(in_flight))
+        with self.metrics.stage("receive"):
+            messages = list(self.queue_client.receive_messages(
+                messages_per_page=count, max_messages=count, visibility_timeout=self.visibility_timeout))
+        for message in messages:
+            self.metrics.record_lag(getattr(message, "inserted_on", None))
+            if message.dequeue_count and message.dequeue_count > self.max_dequeue_count:
+                print(f"Dropping message {message.id} after {message.dequeue_count} attempts")
+                queue_messages.inc(outcome="poison")
+                self._delete([message])
+                continue
+            payload, parts = self.chunk_assembler.add(message.content, message)
+            if payload is None:
+                # Left undeleted until every chunk of the payload has been processed
+                continue
+            in_flight[pool.submit(self._process, payload)] = parts
+        return len(messages)
+
+    def _reap(self, in_flight, timeout):
+        done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            messages = in_flight.pop(future)
+            error = future.exception()
+            if error is None:
+                self._delete(messages)
+            else:
+                print(f"Error processing message {messages[0].id}, leaving it for a retry: {error}")
+            self.metrics.record_result(error is None)
+
+    def run(self, max_idle_polls=None):
+        """
+        Consume until stopped.
+
+        Args:
+            max_idle_polls: Return after this many consecutive empty polls with no work in
+                flight, None to run forever
+        """
+        poll_interval = self.min_poll_interval
+        idle_polls = 0
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                received = 0
+                # Refill the workers that are idle
+                if len(in_flight) < self.workers:
+                    received = self._receive_batch(pool, in_flight)
+
+                if received:
+                    poll_interval = self.min_poll_interval
+                    idle_polls = 0
+                    self._reap(in_flight, timeout=0)
+                elif in_flight:
+                    self._reap(in_flight, timeout=poll_interval)
+                    if not in_flight:
+                        print(f"Consumer metrics: {self.metrics.snapshot()}")
+                else:
+                    idle_polls += 1
+                    if max_idle_polls is not None and idle_polls >= max_idle_polls:
+                        return self.metrics.snapshot()
+                    print(f"No messages in queue, polling again in {poll_interval:.0f}s")
+                    time.sleep(poll_interval)
+                    poll_interval = min(poll_interval * 2, self.max_poll_interval)
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import random
+import re
+import threading
+from datetime import datetime, timezone
+
+
+#Share of distinct words two items need in common to be the same story
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", 0.5))
+SIGNATURE_RETENTION_DAYS = int(os.environ.get("SIGNATURE_RETENTION_DAYS", 30))
+
+MINHASH_PERMUTATIONS = 126
+# 42 bands of 3 rows, items with a Jaccard similarity of 0.4 share a band with 94% probability, 0.5 with 99.6%,
+# and unrelated items with one of 0.1 with 4%
+MINHASH_BANDS = 42
+_ROWS = MINHASH_PERMUTATIONS // MINHASH_BANDS
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+# Fixed seed, signatures are compared with the ones stored by earlier runs
+_rng = random.Random(7)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(_PRIME)) for _ in range(MINHASH_PERMUTATIONS)]
+_words = re.compile(r"\w+")
+_STOPWORDS = frozenset("a an and are as at be by for from has have in is it its of on or that the this to was were will with".split())
+
+
+def shingles(text):
+    """Distinct words of a text without stopwords, rewordings keep most of them."""
+    return {word for word in _words.findall(str(text).lower()) if word not in _STOPWORDS}
+
+
+def minhash(text):
+    """MinHash signature of the shingles of a text, matching values estimate their Jaccard similarity."""
+    values = [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+              for shingle in shingles(text)]
+    if not values:
+        return [_MASK] * MINHASH_PERMUTATIONS
+    return [min((a * value + b) % _PRIME for value in values) & _MASK for a, b in _PERMUTATIONS]
+
+
+def band_keys(signature):
+    """Index keys for the bands of a signature, similar items share at least one."""
+    return [f"m{band}:" + hashlib.blake2b(repr(signature[band * _ROWS:(band + 1) * _ROWS]).encode("ascii"),
+                                          digest_size=8).hexdigest()
+            for band in range(MINHASH_BANDS)]
+
+
+def similarity(a, b):
+    return sum(x == y for x, y in zip(a, b)) / MINHASH_PERMUTATIONS
+
+
+class NearDuplicateFilter:
+    """
+    Drops news items whose title and summary are near duplicates of an item already stored.
+
+    Items are compared by MinHash over their words, and signatures are persisted in a Mongo
+    collection with a multikey index on their LSH bands, so a lookup only compares against
+    the few signatures sharing a band instead of every stored item. The signatures of kept
+    items are reserved as soon as they are checked, so messages processed in parallel see
+    each other's items, and released if storing the items fails. Old signatures expire
+    after SIGNATURE_RETENTION_DAYS.
+    """
+
+    def __init__(self, collection, threshold=DEDUP_THRESHOLD, retention_days=SIGNATURE_RETENTION_DAYS):
+        self.collection = collection
+        self.threshold = threshold
+        self.collection.create_index("bands")
+        self.collection.create_index("created_at", expireAfterSeconds=retention_days * 86400)
+        self.stats = {"kept": 0, "dropped": 0}
+        # Check and reserve are one step for the worker threads of this process
+        self._lock = threading.Lock()
+
+    def filter(self, summaries, cycle_id):
+        """
+        Remove near duplicates from the summarizer output and reserve the kept items.
+
+        Args:
+            summaries: dict of news source -> list of news items
+            cycle_id: Id of the message's publish, its own reservations from an earlier delivery are ignored
+
+        Returns:
+            tuple: The summaries without near duplicates, and the reserved signatures to
+                pass to release if the items can't be stored
+        """
+        items = [(source, item) for source, source_items in summaries.items() if isinstance(source_items, list)
+                 for item in source_items if isinstance(item, dict)]
+        item_signatures = [minhash(f"{item.get('title', '')} {item.get('summary', '')}") for _, item in items]
+        item_keys = [band_keys(signature) for signature in item_signatures]
+        all_keys = {key for keys in item_keys for key in keys}
+        kept = {source: [] for source, source_items in summaries.items() if isinstance(source_items, list)}
+        reserved = []
+
+        with self._lock:
+            # One round trip for every band of every item in the batch
+            seen = {}
+            query = {"bands": {"$in": list(all_keys)}, "minhash": {"$exists": True}, "cycle_id": {"$ne": cycle_id}}
+            for document in self.collection.find(query, {"_id": 0, "minhash": 1, "bands": 1}):
+                for key in all_keys.intersection(document["bands"]):
+                    seen.setdefault(key, []).append(document["minhash"])
+
+            created_at = datetime.now(timezone.utc)
+            for (source, item), signature, keys in zip(items, item_signatures, item_keys):
+                candidates = [candidate for key in keys for candidate in seen.get(key, ())]
+                if any(similarity(signature, candidate) >= self.threshold for candidate in candidates):
+                    self.stats["dropped"] += 1
+                    continue
+                self.stats["kept"] += 1
+                kept[source].append(item)
+                reserved.append({"minhash": signature, "bands": keys, "cycle_id": cycle_id, "title": item.get("title"),
+                                 "source": source, "created_at": created_at})
+                # Also catches the same story from two sources in this batch
+                for key in keys:
+                    seen.setdefault(key, []).append(signature)
+            if reserved:
+                self.collection.insert_many(reserved)
+        return kept, reserved
+
+    def release(self, reserved):
+        """Drop the reservations of items that could not be stored."""
+        if reserved:
+            self.collection.delete_many({"_id": {"$in": [signature["_id"] for signature in reserved]}})
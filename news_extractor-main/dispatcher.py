@@ -0,0 +1,201 @@
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import urllib3
+from certifi import where
+from informatica_shared.instrumentation import counter, histogram
+
+from common import RateLimiter, percentile
+
+
+NOVU_API_URL = os.environ.get("NOVU_API_URL", "https://api.novu.co")
+NOVU_WORKFLOW = os.environ.get("NOVU_WORKFLOW", "emailerworkflow")
+EMAIL_CONCURRENCY = int(os.environ.get("EMAIL_CONCURRENCY", 8))
+#Requests per second allowed by the Novu plan
+EMAIL_RATE_LIMIT = float(os.environ.get("EMAIL_RATE_LIMIT", 20))
+EMAIL_RETRIES = int(os.environ.get("EMAIL_RETRIES", 3))
+EMAIL_BACKOFF = float(os.environ.get("EMAIL_BACKOFF", 1))
+EMAIL_TIMEOUT = float(os.environ.get("EMAIL_TIMEOUT", 30))
+#Novu accepts up to 100 events per bulk trigger and 100 subscribers per event
+EMAIL_BULK_SIZE = int(os.environ.get("EMAIL_BULK_SIZE", 10))
+EMAIL_RECIPIENTS_PER_EVENT = int(os.environ.get("EMAIL_RECIPIENTS_PER_EVENT", 100))
+
+email_request_duration = histogram("email_request_duration_seconds", "Duration of Novu trigger requests")
+email_recipients = counter("email_recipients_total", "Newsletter recipients by outcome", ("outcome",))
+
+
+def subscriber_id(email):
+    # Stable per address, so repeated sends reuse the same Novu subscriber
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"mailto:{email}"))
+
+
+class DispatchMetrics:
+    """Thread safe sent and failed recipients and request latency for one dispatch cycle."""
+
+    def __init__(self, window=10000):
+        self.started = time.time()
+        self.sent = 0
+        self.failed = 0
+        self.requests = 0
+        self.retries = 0
+        self.latency = deque(maxlen=window)
+        self.failed_users = []
+        self._lock = threading.Lock()
+
+    def record_request(self, seconds, retried):
+        email_request_duration.observe(seconds)
+        with self._lock:
+            self.requests += 1
+            self.retries += retried
+            self.latency.append(seconds)
+
+    def record_result(self, sent, failed_events=()):
+        failed_users = [recipient["email"] for event in failed_events for recipient in event["to"]]
+        email_recipients.inc(sent, outcome="sent")
+        email_recipients.inc(len(failed_users), outcome="failed")
+        with self._lock:
+            self.sent += sent
+            self.failed += len(failed_users)
+            self.failed_users.extend(failed_users)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "sent": self.sent,
+                "failed": self.failed,
+                "requests": self.requests,
+                "retries": self.retries,
+                "elapsed_s": round(time.time() - self.started, 3),
+                "request_latency_s": {"p50": round(percentile(self.latency, 0.5), 3),
+                                      "p95": round(percentile(self.latency, 0.95), 3)},
+            }
+
+
+class EmailDispatcher:
+    """
+    Sends newsletters through Novu over a shared connection pool.
+
+    Recipients of the same newsletter share one trigger event, and events are batched into
+    bulk trigger requests. Requests run on a bounded pool, are rate limited and are retried
+    with jittered exponential backoff on connection errors, 429 and 5xx responses.
+    """
+
+    def __init__(self, api_key, api_url=NOVU_API_URL, workflow=NOVU_WORKFLOW, concurrency=EMAIL_CONCURRENCY,
+                 rate_limit=EMAIL_RATE_LIMIT, retries=EMAIL_RETRIES, backoff=EMAIL_BACKOFF, timeout=EMAIL_TIMEOUT,
+                 bulk_size=EMAIL_BULK_SIZE, recipients_per_event=EMAIL_RECIPIENTS_PER_EVENT):
+        self.api_key = api_key
+        self.api_url = api_url.rstrip("/")
+        self.workflow = workflow
+        self.concurrency = max(1, concurrency)
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.retries = retries
+        self.backoff = backoff
+        self.bulk_size = max(1, min(bulk_size, 100))
+        self.recipients_per_event = max(1, min(recipients_per_event, 100))
+        self.http = urllib3.PoolManager(num_pools=4, maxsize=self.concurrency, block=True,
+                                        cert_reqs='CERT_REQUIRED', ca_certs=where(),
+                                        timeout=urllib3.Timeout(total=timeout), retries=False)
+
+    def _headers(self):
+        return {
+            'Authorization': 'ApiKey ' + self.api_key,
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        }
+
+    def events(self, newsletters):
+        """Trigger events for (users, html) newsletters, as (recipient count, event) pairs."""
+        for users, content_html in newsletters:
+            users = list(users)
+            for i in range(0, len(users), self.recipients_per_event):
+                recipients = [{"subscriberId": subscriber_id(user), "email": user}
+                              for user in users[i:i + self.recipients_per_event]]
+                yield len(recipients), {
+                    "name": self.workflow,
+                    "to": recipients,
+                    "payload": {'Message': content_html},
+                }
+
+    def _post(self, path, body, metrics):
+        encoded_data = json.dumps(body).encode('utf-8')
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.acquire()
+            started = time.perf_counter()
+            retry_after = None
+            try:
+                response = self.http.request('POST', self.api_url + path, headers=self._headers(), body=encoded_data)
+                metrics.record_request(time.perf_counter() - started, attempt > 0)
+                if response.status < 300:
+                    return response
+                error = f"HTTP {response.status}: {response.data[:200]!r}"
+                if response.status != 429 and response.status < 500:
+                    raise RuntimeError(error)
+                retry_after = response.headers.get("Retry-After")
+            except urllib3.exceptions.HTTPError as e:
+                metrics.record_request(time.perf_counter() - started, attempt > 0)
+                error = str(e)
+            print(f"Error sending to Novu (attempt {attempt + 1}): {error}")
+            if attempt < self.retries:
+                delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+                time.sleep(delay)
+        raise RuntimeError(error)
+
+    def _send_batch(self, batch, metrics):
+        recipients = sum(count for count, _ in batch)
+        try:
+            if len(batch) == 1:
+                self._post("/v1/events/trigger", batch[0][1], metrics)
+                metrics.record_result(recipients)
+                return
+            response = self._post("/v1/events/trigger/bulk", {"events": [event for _, event in batch]}, metrics)
+        except Exception as e:
+            print(f"Failed to send newsletter to {recipients} recipients: {e}")
+            metrics.record_result(0, [event for _, event in batch])
+            return
+
+        # Bulk responses acknowledge each event separately
+        try:
+            results = json.loads(response.data).get("data") or []
+        except (ValueError, AttributeError):
+            results = []
+        failed = [(count, event) for (count, event), result in zip(batch, results)
+                  if isinstance(result, dict) and result.get("acknowledged") is False]
+        metrics.record_result(recipients - sum(count for count, _ in failed), [event for _, event in failed])
+
+    def send(self, newsletters, failed_users=None):
+        """
+        Send every newsletter and wait for the sends to finish.
+
+        Args:
+            newsletters: Iterable of (users, html) pairs, users sharing a newsletter are
+                sent one event
+            failed_users: Optional list, extended with the recipients whose send failed
+
+        Returns:
+            dict: Metrics snapshot of this dispatch
+        """
+        metrics = DispatchMetrics()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            in_flight = deque()
+            batch = []
+            for event in self.events(newsletters):
+                batch.append(event)
+                if len(batch) == self.bulk_size:
+                    in_flight.append(pool.submit(self._send_batch, batch, metrics))
+                    batch = []
+                # Keep rendering and sending in step instead of queueing every newsletter
+                while len(in_flight) > self.concurrency * 2:
+                    in_flight.popleft().result()
+            if batch:
+                in_flight.append(pool.submit(self._send_batch, batch, metrics))
+        if failed_users is not None:
+            failed_users.extend(metrics.failed_users)
+        return metrics.snapshot()
@@ -0,0 +1,113 @@
+import base64
+import hashlib
+import json
+import zlib
+from datetime import datetime, timezone
+
+from scrape_cache import content_hash
+
+
+# Azure Queue messages are capped at 64 KB after the Base64 encode policy, which adds a third
+AZURE_MESSAGE_MAX_BYTES = 64 * 1024 * 3 // 4
+_CHUNK_OVERHEAD_BYTES = 256
+
+
+def build_envelope(url, markdown, fetched_at=None, trace_id=None):
+    """Message envelope for a single scraped source, with the markdown zlib compressed."""
+    fetched_at = fetched_at or datetime.now(timezone.utc)
+    return {
+        "url": url,
+        "fetched_at": fetched_at.isoformat(),
+        # Lets the subscriber continue the extractor's trace
+        "trace_id": trace_id,
+        "content_hash": content_hash(markdown),
+        "encoding": "zlib+base64",
+        "markdown": base64.b64encode(zlib.compress(markdown.encode("utf-8"), 9)).decode("ascii"),
+    }
+
+
+def encode_envelope(envelope):
+    """Serialize an envelope to the bytes sent to every sink."""
+    return json.dumps(envelope, separators=(",", ":")).encode("utf-8")
+
+
+def split_message(payload, max_bytes=AZURE_MESSAGE_MAX_BYTES):
+    """
+    Split a payload into messages that fit the queue limit.
+
+    Payloads that already fit are sent as is. Larger ones are cut into chunk messages that
+    carry the id of the whole payload and their position, to be put back together by
+    ChunkAssembler on the consumer side.
+    """
+    if len(payload) <= max_bytes:
+        return [payload]
+    message_id = hashlib.sha256(payload).hexdigest()[:16]
+    # Chunk data is Base64 encoded so it survives the JSON wrapper unescaped
+    step = (max_bytes - _CHUNK_OVERHEAD_BYTES) * 3 // 4
+    parts = [payload[i:i + step] for i in range(0, len(payload), step)]
+    return [
+        json.dumps({
+            "chunk_of": message_id,
+            "part": index,
+            "parts": len(parts),
+            "data": base64.b64encode(part).decode("ascii"),
+        }, separators=(",", ":")).encode("utf-8")
+        for index, part in enumerate(parts)
+    ]
+
+
+class ChunkAssembler:
+    """Collects chunk messages until every part of a payload has arrived."""
+
+    def __init__(self):
+        self.pending = {}
+
+    def add(self, content, message=None):
+        """
+        Add a received message.
+
+        Args:
+            content: Message content
+            message: Queue message the content came from, handed back with the payload
+
+        Returns:
+            tuple: The whole payload and the messages it was built from once complete,
+                (None, None) while parts are still missing
+        """
+        try:
+            chunk = json.loads(content)
+        except (TypeError, ValueError):
+            return content, [message]
+        if not isinstance(chunk, dict) or "chunk_of" not in chunk:
+            return content, [message]
+
+        parts = self.pending.setdefault(chunk["chunk_of"], {})
+        # Redelivered chunks replace their earlier copy, keeping the latest message receipt
+        parts[chunk["part"]] = (base64.b64decode(chunk["data"]), message)
+        if len(parts) < chunk["parts"]:
+            return None, None
+        del self.pending[chunk["chunk_of"]]
+        ordered = [parts[index] for index in range(chunk["parts"])]
+        return b"".join(data for data, _ in ordered), [message for _, message in ordered]
+
+
+def decode_envelope(payload):
+    """
+    Read a payload back into an envelope with the markdown decompressed.
+
+    Messages published before the envelope format are returned with the raw content as
+    the markdown and no url.
+    """
+    try:
+        envelope = json.loads(payload)
+    except (TypeError, ValueError):
+        envelope = None
+    if not isinstance(envelope, dict) or envelope.get("encoding") != "zlib+base64":
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8", errors="replace")
+        return {"url": None, "fetched_at": None, "trace_id": None, "content_hash": content_hash(payload), "markdown": payload}
+
+    envelope = dict(envelope)
+    envelope.setdefault("trace_id", None)
+    envelope["markdown"] = zlib.decompress(base64.b64decode(envelope["markdown"])).decode("utf-8")
+    return envelope
@@ -0,0 +1,77 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from informatica_shared.instrumentation import bind_context, counter, span
+
+
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 64))
+EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", 4))
+VECTOR_INSERT_BATCH_SIZE = int(os.environ.get("VECTOR_INSERT_BATCH_SIZE", 500))
+
+NEWS_ITEM_FIELDS = ("title", "summary", "link", "topic")
+
+embedded_texts = counter("embedding_texts_total", "Texts sent to the embedding function")
+
+
+def news_documents(summaries):
+    """
+    Split the summarizer output into one document per news item.
+
+    Args:
+        summaries: dict of news source -> list of news items
+
+    Returns:
+        tuple: texts to embed and their metadata, in the same order
+    """
+    texts, metadatas = [], []
+    for source, items in summaries.items():
+        if not isinstance(items, list):
+            continue
+        for item in items:
+            if not isinstance(item, dict) or not (item.get("title") or item.get("summary")):
+                continue
+            metadata = {field: str(item.get(field) or "") for field in NEWS_ITEM_FIELDS}
+            metadata["source"] = source
+            texts.append(f"{metadata['title']}\n{metadata['summary']}".strip())
+            metadatas.append(metadata)
+    return texts, metadatas
+
+
+def _embed_batch(embedding, batch):
+    with span("embedding", texts=len(batch)):
+        vectors = embedding.embed_documents(batch)
+    embedded_texts.inc(len(batch))
+    return vectors
+
+
+def embed_in_batches(texts, embedding, batch_size=EMBEDDING_BATCH_SIZE, concurrency=EMBEDDING_CONCURRENCY):
+    """Embed texts in batches of batch_size, with at most concurrency requests in flight."""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    if not batches:
+        return []
+    embed_batch = bind_context(_embed_batch)
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(batches)))) as pool:
+        embedded = pool.map(lambda batch: embed_batch(embedding, batch), batches)
+        return [vector for batch in embedded for vector in batch]
+
+
+def ingest_news(summaries, vector_store, embedding, batch_size=EMBEDDING_BATCH_SIZE,
+                concurrency=EMBEDDING_CONCURRENCY, insert_batch_size=VECTOR_INSERT_BATCH_SIZE, mirrors=()):
+    """
+    Embed every news item in the summaries and bulk insert them into the vector store.
+
+    Mirrors, like the local vector index, get the same vectors without embedding again.
+
+    Returns:
+        int: Number of news items inserted
+    """
+    texts, metadatas = news_documents(summaries)
+    if not texts:
+        return 0
+    vectors = embed_in_batches(texts, embedding, batch_size=batch_size, concurrency=concurrency)
+    with span("vector_insert", store=type(vector_store).__name__, rows=len(texts)):
+        vector_store.add_embeddings(texts=texts, embeddings=vectors, metadatas=metadatas, batch_size=insert_batch_size)
+    for mirror in mirrors:
+        with span("vector_insert", store=type(mirror).__name__, rows=len(texts)):
+            mirror.add_embeddings(texts=texts, embeddings=vectors, metadatas=metadatas, batch_size=insert_batch_size)
+    return len(texts)
@@ -1,46 +1,40 @@
 import os
 import time
-from azure.storage.queue import QueueServiceClient, QueueClient, QueueMessage, BinaryBase64DecodePolicy, BinaryBase64EncodePolicy
-from firecrawl import FirecrawlApp
-from google.cloud import pubsub_v1
 import json
-import ast
-import re
-import base64
+from scraper import scrape_sources
+from scrape_cache import ScrapeCache
+from envelope import build_envelope, encode_envelope, split_message
+from informatica_shared.instrumentation import counter, serve_metrics, span, trace
+from informatica_shared.llm_json import parse_llm_json
+from clients import azure_queue, firecrawl, pubsub_publisher
 
 
 
-firecrawl_key = os.environ["FIRECRAWL_KEY"]
-azure_queue_name = "raw-to-informatica-queue"
-azure_queue_url = "https://rawtoinformatica.queue.core.windows.net/raw-to-informatica-queue"
-azure_connection_string = os.environ["AZURE_CONNECTION_STRING"]
-
-project_id = os.environ["PROJECT_ID"]
-topic_id = os.environ["PUB_TOPIC_ID"]
-publisher = pubsub_v1.PublisherClient()
-topic_path = publisher.topic_path(project_id, topic_id)
-# print("Publishing message to topic: {}".format(topic_path))
-
-crawl_app = FirecrawlApp(api_key=firecrawl_key)
-queue_client = QueueClient.from_connection_string(azure_connection_string, azure_queue_name, message_encode_policy=BinaryBase64EncodePolicy(), message_decode_policy=BinaryBase64DecodePolicy())
+us_finance_new_sources = ["https://www.finance.yahoo.com","https://www.google.com/finance/?hl=en"]
+published_bytes = counter("queue_published_bytes_total", "Payload bytes published", ("sink",))
 
 
 #Function to extract the news
 def extract_news(url):
     #Basic Crawl for MVP
-    scrape_result = crawl_app.scrape_url(url, params={'formats': ['markdown']})
-    return str(scrape_result)
+    scrape_result = firecrawl.get().scrape_url(url, params={'formats': ['markdown']})
+    return scrape_result.get('markdown') or str(scrape_result)
 
 #push raw data to kafka
 def push_to_google_pub_sub(data):
-    data = str(data).encode('utf-8')
-    future = publisher.publish(topic_path, data)
-    print(future.result())
+    with span("queue_publish", sink="pubsub", bytes=len(data)):
+        publisher = pubsub_publisher.get()
+        future = publisher.publish(publisher.topic_path(os.environ["PROJECT_ID"], os.environ["PUB_TOPIC_ID"]), data)
+        print(future.result())
+    published_bytes.inc(len(data), sink="pubsub")
 
 def push_to_azure_queue(data):
-    #ENCODE base 64
-    data = data.encode('utf-8')
-    queue_client.send_message(data)
+    #Base 64 encoded by the queue policy, large payloads go out as several chunks
+    with span("queue_publish", sink="azure", bytes=len(data)):
+        queue_client = azure_queue.get()
+        for message in split_message(data):
+            queue_client.send_message(message)
+    published_bytes.inc(len(data), sink="azure")
     print("Message sent to Azure Queue")
 
 
@@ -52,76 +46,53 @@ def format_json(data):
         data: Input data to be formatted (dict, str, etc.)
 
     Returns:
-        str: Properly formatted JSON string
+        str: Properly formatted JSON string, or the input as a string if it isn't JSON
     """
-    try:
-        # Handle different input types
-        if isinstance(data, str):
-            # Remove newline characters and specific markers
-            data = data.replace('\n', '').replace('\\_ns', '')
-
-            # Try multiple parsing strategies
-            try:
-                # First, try direct JSON parsing
-                parsed_data = json.loads(data)
-            except json.JSONDecodeError:
-                try:
-                    # If JSON parsing fails, try literal evaluation
-                    parsed_data = ast.literal_eval(data)
-                except (SyntaxError, ValueError):
-                    # Last resort: attempt to clean and parse
-                    try:
-                        # Remove leading/trailing braces if misplaced
-                        data = data.strip('{}')
-
-                        # Add quotes around keys if missing
-                        data = re.sub(r'(\w+):', r'"\1":', data)
-                        parsed_data = json.loads('{' + data + '}')
-                    except Exception:
-                        return str(data)
-        else:
-            # If not a string, assume it's already a dict or can be directly converted
-            parsed_data = data
-
-        # Special handling for Yahoo Finance nested JSON
-        if isinstance(parsed_data, dict) and 'markdown' in parsed_data:
-            # Extract and parse the nested markdown/JSON content
-            try:
-                nested_content = json.loads(parsed_data['markdown'])
-                parsed_data['markdown_parsed'] = nested_content
-            except Exception:
-                pass
-
-        # Convert to JSON string with enhanced formatting
-        return json.dumps(parsed_data,
-                          indent=2,
-                          ensure_ascii=False,
-                          sort_keys=True)
-
-    except Exception as e:
-        # Comprehensive error handling
-        return f"Error formatting JSON: {str(e)}"
+    parsed_data = parse_llm_json(data, allow_prose=True)
+    if parsed_data is None:
+        return str(data)
+
+    # Special handling for Yahoo Finance nested JSON
+    if isinstance(parsed_data, dict) and 'markdown' in parsed_data:
+        nested_content = parse_llm_json(parsed_data['markdown'])
+        if nested_content is not None:
+            parsed_data['markdown_parsed'] = nested_content
+
+    return json.dumps(parsed_data,
+                      indent=2,
+                      ensure_ascii=False,
+                      sort_keys=True)
+
+
+
+def run_extraction(scrape_cache, sources=us_finance_new_sources):
+    """One scrape and publish cycle, returns the urls published."""
+    #One trace per cycle, carried to the subscriber in the envelopes
+    with trace() as trace_id:
+        #Skip sources fetched within the cache TTL
+        stale_sources = [url for url in sources if not scrape_cache.is_fresh(url)]
+        #Scrape all sources concurrently, failed sources are left out
+        scraped = scrape_sources(stale_sources, extract_news)
+        #Only publish sources whose content changed since the last publish
+        changed = {url: data for url, data in scraped.items() if not scrape_cache.is_unchanged(url, data)}
+        for url, data in changed.items():
+            print(url)
+            #One message per source, serialized once for both sinks
+            payload = encode_envelope(build_envelope(url, data, trace_id=trace_id))
+            #Push to Azure Queue
+            push_to_azure_queue(payload)
+            #Push to Google Pub/Sub
+            push_to_google_pub_sub(payload)
+            scrape_cache.record(url, data)
+        print(f"Scrape cache stats: {scrape_cache.stats}")
+    return list(changed)
 
 
 
 if __name__ == "__main__":
-    us_finance_new_sources = ["https://www.finance.yahoo.com","https://www.google.com/finance/?hl=en"]
-    data_in={}
+    scrape_cache = ScrapeCache()
+    serve_metrics()
     while True:
-        for url in us_finance_new_sources:
-            print(url)
-            data = extract_news(url)
-            data_in.update({
-                "url": url,
-                "data": data})
-
-
-            #Push to Azure Queue
-        push_to_azure_queue(json.dumps(data_in))
-        #Push to Google Pub/Sub
-        push_to_google_pub_sub(json.dumps(data_in))
-
+        run_extraction(scrape_cache)
         #wait 6 hours
         time.sleep(21600)
-
-
@@ -1,123 +1,153 @@
-import copy
 import json
-import uuid
-import urllib3
-from certifi import where
-from pymongo import MongoClient
 import os
-from bs4 import BeautifulSoup
-from collections import defaultdict
 import time
-
-
-mongo_client = MongoClient(os.environ["MONGO_URI"], tlsCAFile=where())
-novu_key = os.environ['NOVU_KEY']
-db = mongo_client["informatica_ai"]
-all_news_db = db["all_news"]
-user_preferences_db = db["user_preferences"]
+from datetime import datetime, timedelta, timezone
+from clients import all_news, database, mongo
+from dispatcher import EmailDispatcher
+from informatica_shared.instrumentation import serve_metrics, span, trace
+from newsletter import FragmentCache, NewsletterTemplate, TopicIndex, render_newsletters
+from informatica_shared.resources import resource
+
+
+USER_BATCH_SIZE = int(os.environ.get("USER_BATCH_SIZE", 5000))
+#Single document of the newsletter_state collection, holding the ingested_at of the last article sent
+WATERMARK_ID = "newsletter"
+NEWSLETTER_INTERVAL = float(os.environ.get("NEWSLETTER_INTERVAL", 43200))
+NEWSLETTER_FIRST_LOOKBACK = float(os.environ.get("NEWSLETTER_FIRST_LOOKBACK", 43200))
+NEWSLETTER_SETTLE_SECONDS = float(os.environ.get("NEWSLETTER_SETTLE_SECONDS", 60))
+#Recipients whose send failed are retried from their own watermark for this long
+NEWSLETTER_RETRY_SECONDS = float(os.environ.get("NEWSLETTER_RETRY_SECONDS", 7 * 86400))
 template_path = os.path.join(os.path.dirname(__file__), "email_template.html")
 template = open(template_path).read()
-soup = BeautifulSoup(template, "html.parser")
-
-article_template = soup.find('div', class_='columns')
+newsletter_template = NewsletterTemplate(template)
+fragment_cache = FragmentCache(newsletter_template)
+#One pooled client for every send, instead of a new connection per recipient
+dispatcher = resource("novu_dispatcher", lambda: EmailDispatcher(os.environ["NOVU_KEY"]))
 
-if not article_template:
-    raise ValueError("Article template with class 'columns' not found in the HTML template.")
+def create_retries_collection():
+    #One document per recipient whose send failed, with the watermark of the articles they missed
+    collection = database()["newsletter_retries"]
+    collection.create_index("failed_at", expireAfterSeconds=int(NEWSLETTER_RETRY_SECONDS))
+    return collection
 
-# Split HTML into start and end parts
-article_str = str(article_template)
-html_start = str(soup).split(article_str, 1)[0].replace('\n', '')
-html_end = str(soup).split(article_str, 1)[1].replace('\n', '')
+retries = resource("newsletter_retries", create_retries_collection, requires=(mongo,))
 
 def prepare_news_letter(news):
-    html = html_start
-    for news_item in news:
-        article = copy.deepcopy(article_template)  # Deep copy to avoid modifying the original
-        # Set article details
-        if article.find('h1'):
-            article.find('h1').string = news_item["title"]
-        if article.find('p'):
-            article.find('p').string = news_item["summary"]
-        if article.find('a'):
-            article.find('a')['href'] = news_item["link"]
-            article.find('a').string = f"Read More on {news_item['source']}"
-
-        # Handle multiple spans (topic and source)
-        spans = article.find_all('span')
-        if len(spans) > 0:
-            spans[0].string = news_item["topic"]
-        if len(spans) > 1:
-            spans[1].string = news_item["source"]
-
-        if article.find('img'):
-            article.find('img')['src'] = f"https://picsum.photos/seed/{news_item['title']}/800/400"
-        html += str(article)
-
-    html += html_end
-    return html
-
-
-
-def send_email(user, news):
-    content_html = prepare_news_letter(news)
-    url = 'https://api.novu.co/v1/events/trigger'
-    headers = {
-        'Authorization': 'ApiKey ' + novu_key,
-        'Content-Type': 'application/json',
-        'Accept': 'application/json'
-    }
-
-    data = {
-        "name": "emailerworkflow",
-        "to": {
-            "subscriberId": str(uuid.uuid4()),
-            "email": user
-        },
-        "payload": ({'Message': content_html })
-    }
-
-    # Send the POST request
-    http = urllib3.PoolManager(cert_reqs='CERT_REQUIRED', ca_certs=where())
-    encoded_data = json.dumps(data).encode('utf-8')
-    response = http.request('POST', url, headers=headers, body=encoded_data)
-
-    return response
-
-
-
-
-
+    return newsletter_template.render(newsletter_template.render_article(news_item) for news_item in news)
+
+
+
+def send_email(user, content_html):
+    return dispatcher.get().send([([user], content_html)])
+
+
+
+def load_watermark():
+    #Articles ingested up to the watermark were already sent
+    state = database()["newsletter_state"].find_one({"_id": WATERMARK_ID})
+    if state is None:
+        return None, datetime.now(timezone.utc) - timedelta(seconds=NEWSLETTER_FIRST_LOOKBACK)
+    return state["watermark"], state["watermark"]
+
+def articles_since(since, until):
+    #Range scan on the ingested_at index, newest first
+    projection={"_id": 0, "title": 1, "summary": 1, "link": 1, "topic": 1, "source": 1, "cycle_id": 1}
+    query={"ingested_at": {"$gt": since, "$lte": until}}
+    return list(all_news.get().find(query, projection).sort([("ingested_at", -1)]))
+
+def advance_watermark(previous, watermark):
+    #Compare and set, only moves on from the value this run read
+    from pymongo.errors import DuplicateKeyError
+    try:
+        database()["newsletter_state"].update_one({"_id": WATERMARK_ID, "watermark": previous},
+                                                  {"$set": {"watermark": watermark, "updated_at": datetime.now(timezone.utc)}},
+                                                  upsert=True)
+        return True
+    except DuplicateKeyError:
+        #Another run moved the watermark first
+        return False
+
+def user_topics(query=None):
+    #Stream the preferences with only the fields needed, instead of loading every user first
+    for user in database()["user_preferences"].find(query or {}, {"_id": 0, "user_id": 1, "preference": 1}, batch_size=USER_BATCH_SIZE):
+        try:
+            yield user["user_id"], json.loads(user['preference'])["topics"]
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Skipping invalid preference of {user.get('user_id')}: {e}")
+
+def load_retries():
+    return {retry["_id"]: retry["since"] for retry in retries.get().find({}, {"since": 1})}
+
+def record_failures(users, since):
+    #Keep the oldest watermark if a recipient failed again
+    now = datetime.now(timezone.utc)
+    for user in set(users):
+        retries.get().update_one({"_id": user}, {"$min": {"since": since}, "$set": {"failed_at": now}}, upsert=True)
+
+def resend_failed(pending, until):
+    #Recipients whose last send failed get every article since their own watermark
+    by_since = {}
+    for user, since in pending.items():
+        by_since.setdefault(since, []).append(user)
+    sent = 0
+    for since, users in by_since.items():
+        with span("mongo", operation="articles_since"):
+            news = articles_since(since, until)
+        index = TopicIndex(news).add_subscribers(user_topics({"user_id": {"$in": users}}))
+        #Rendered apart from the fragment cache, which only holds the current cycle's articles
+        fragments = [newsletter_template.render_article(news_item) for news_item in news]
+        failed = []
+        metrics = dispatcher.get().send(render_newsletters(newsletter_template, index, fragments), failed_users=failed)
+        sent += metrics["sent"]
+        #Recipients without matching articles are done as well
+        done = set(users).difference(failed)
+        if done:
+            retries.get().delete_many({"_id": {"$in": list(done)}})
+    return sent
 
 def find_user_and_news():
-    user_dict=defaultdict() #key:email_id, value:topics
-    for user in user_preferences_db.find():
-        usert = json.loads(user['preference'])
-        user_dict[user["user_id"]]=usert["topics"]
-
-    latest_news = list(all_news_db.find({}, {"_id": 0}).sort([("_id", -1)]).limit(3))
-    for user in user_dict.keys():
-        user_realted_news=[]
-        for news_item in latest_news:
-            for i,j in news_item.items():
-                for news in j:
-                    if news["topic"] in user_dict[user]:
-                        news_dict={
-                            "title":news["title"],
-                            "summary":news["summary"],
-                            "link":news["link"],
-                            "topic":news["topic"],
-                            "source":i
-                        }
-                        user_realted_news.append(news_dict)
-        if user_realted_news:
-            send_email(user,user_realted_news)
-            # print("Sending email to user",user)
+    with trace(), span("newsletter_run"):
+        return send_newsletters()
+
+def send_newsletters():
+    previous, since = load_watermark()
+    #Leave a margin for articles whose insert is still in flight
+    until = datetime.now(timezone.utc) - timedelta(seconds=NEWSLETTER_SETTLE_SECONDS)
+    with span("mongo", operation="articles_since"):
+        latest_news = articles_since(since, until)
+    pending = load_retries()
+    if pending:
+        with span("newsletter_retry"):
+            resent = resend_failed(pending, until)
+        print(f"Resent newsletters to {resent} of {len(pending)} recipients whose last send failed")
+    if not latest_news:
+        print(f"No news ingested since {since}")
+        return None
+
+    fragments = fragment_cache.render(latest_news)
+    with span("newsletter_match"):
+        #Recipients being retried already got these articles with the ones they missed
+        index = TopicIndex(latest_news).add_subscribers((user, topics) for user, topics in user_topics() if user not in pending)
+    newsletters = render_newsletters(newsletter_template, index, fragments)
+    failed = []
+    with span("newsletter_dispatch"):
+        metrics = dispatcher.get().send(newsletters, failed_users=failed)
+    print(f"Newsletter dispatch metrics: {metrics}")
+    #Resending to everyone because some sends failed would repeat news for the rest, only retry a run that sent nothing
+    if metrics["failed"] and not metrics["sent"]:
+        print(f"Every send failed, keeping the watermark at {since}")
+        return metrics
+    #The rest move on, the failed recipients are resent these articles from their own watermark next run
+    record_failures(failed, since)
+    if not advance_watermark(previous, until):
+        print("Newsletter watermark was moved by another run")
+    return metrics
 
 if __name__ == "__main__":
+    serve_metrics()
     while True:
         find_user_and_news()
-        #resend in 12 hours
-        time.sleep(43200)
+        time.sleep(NEWSLETTER_INTERVAL)
 
 
 
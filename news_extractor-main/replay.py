@@ -0,0 +1,319 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+import types
+from datetime import datetime, timezone
+
+BENCH_MONGO_URI = os.environ.get("BENCH_MONGO_URI")
+
+# Read at import by the pipeline modules, their clients are the stand-ins set in load_pipeline
+for name, value in (("PROJECT_ID", "replay"), ("PUB_TOPIC_ID", "replay"), ("EMBEDDING_CACHE_PATH", ":memory:"),
+                    ("QUEUE_MIN_POLL_INTERVAL", "0.01"), ("NEWSLETTER_SETTLE_SECONDS", "0")):
+    os.environ.setdefault(name, value)
+
+import pymongo
+from informatica_shared.baseline import compare_to_baseline
+from informatica_shared.embedding_cache import CachedEmbeddings
+from informatica_shared.instrumentation import span_duration
+from informatica_shared.resources import RESOURCES
+
+from benchmark import NEWSLETTER_TOPICS, FakeEmbeddings, FakeOpenAI, InMemoryQueue, InMemoryVectorStore, NovuStub
+from dispatcher import EMAIL_RATE_LIMIT, EmailDispatcher
+from scrape_cache import ScrapeCache
+
+
+COMPANIES = ["Acme Robotics", "Borealis Energy", "Cobalt Mining", "Delta Freight", "Evergreen Foods", "Fathom Semiconductors",
+             "Granite Homes", "Harbor Bank", "Ion Telecom", "Juniper Health", "Keystone Utilities", "Lumen Devices",
+             "Meridian Retail", "Nimbus Cloud", "Orchid Pharma", "Pinnacle Insurance", "Quarry Metals", "Redwood REIT",
+             "Summit Motors", "Tidewater Oil", "Umbra Media", "Vertex Payments", "Willow Apparel", "Xenon Batteries"]
+EVENTS = ["beats earnings estimates", "cuts full year guidance", "announces share buyback", "wins antitrust appeal",
+          "recalls flagship product", "names new chief executive", "expands into Asian markets", "faces supplier strike",
+          "raises quarterly dividend", "settles patent dispute", "files for debt offering", "lands government contract",
+          "delays product launch", "agrees to acquire rival", "reports data breach", "unveils cost cutting plan"]
+DRIVERS = ["as rates fall", "amid tariff worries", "after analyst upgrade", "on strong consumer demand", "despite weak orders",
+           "ahead of investor day", "as inflation cools", "on supply chain relief", "after regulator review",
+           "as shares hit record", "amid currency swings", "on takeover speculation"]
+
+
+def load_scrape_fixtures(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def fake_story(rng, words):
+    title = f"{rng.choice(COMPANIES)} {rng.choice(EVENTS)} {rng.choice(DRIVERS)}, ticker {rng.randrange(10 ** 6):06d}"
+    body = " ".join(rng.choice(("shares", "analysts", "quarter", "revenue", "guidance", "investors", "market", "outlook",
+                                "margin", "demand", "sector", "index")) for _ in range(words))
+    return f"## {title}\n\n{body.capitalize()}.\n\n[Read more](https://news.example.com/{rng.randrange(10 ** 9)})"
+
+
+class ReplayFirecrawl:
+    """
+    Stand-in for FirecrawlApp serving recorded pages.
+
+    Source i gets recorded page i modulo the fixture count, with new stories added every
+    cycle so the page changes like a live front page. Every scrape sleeps for latency.
+    """
+
+    def __init__(self, fixtures, latency=0.2, seed=0):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.pages = {}
+        self.calls = 0
+
+    def next_cycle(self, urls, stories, words_per_story):
+        self.pages = {}
+        for i, url in enumerate(urls):
+            count = stories // len(urls) + (i < stories % len(urls))
+            new_stories = [fake_story(self.rng, words_per_story) for _ in range(count)]
+            self.pages[url] = "\n\n".join([self.fixtures[i % len(self.fixtures)]["markdown"]] + new_stories)
+
+    def scrape_url(self, url, params=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        return {"markdown": self.pages[url], "metadata": {"sourceURL": url}}
+
+
+class ReplayPublisher:
+    """Stand-in for the Pub/Sub PublisherClient whose publishes complete at once."""
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    def topic_path(self, project_id, topic_id):
+        return f"projects/{project_id}/topics/{topic_id}"
+
+    def publish(self, topic, data):
+        self.messages += 1
+        self.bytes += len(data)
+        return types.SimpleNamespace(result=lambda: str(self.messages))
+
+
+def load_pipeline(args):
+    """
+    Import the extractor, subscriber and notifier against local stand-ins.
+
+    Returns:
+        SimpleNamespace: The three modules and the stand-ins they were given
+    """
+    fixtures = load_scrape_fixtures(args.fixtures)
+    stand_ins = types.SimpleNamespace(
+        firecrawl=ReplayFirecrawl(fixtures, latency=args.scrape_latency, seed=args.seed),
+        queue=InMemoryQueue(),
+        publisher=ReplayPublisher(),
+        llm=FakeOpenAI(latency=args.llm_latency, item_latency=args.llm_item_latency),
+        embeddings=FakeEmbeddings(latency=args.embedding_latency),
+        vector_store=InMemoryVectorStore(latency=args.vector_latency),
+        novu=NovuStub(latency=args.email_latency),
+    )
+    # One client for every module, so the notifier reads what the subscriber wrote
+    if BENCH_MONGO_URI:
+        mongo_client = pymongo.MongoClient(BENCH_MONGO_URI)
+    else:
+        import mongomock
+        mongo_client = mongomock.MongoClient()
+    db = mongo_client["informatica_ai"]
+    for collection in ("all_news", "news_signatures", "user_preferences", "newsletter_state", "newsletter_retries"):
+        db.drop_collection(collection)
+
+    RESOURCES.set("firecrawl", stand_ins.firecrawl)
+    RESOURCES.set("azure_queue", stand_ins.queue)
+    RESOURCES.set("pubsub_publisher", stand_ins.publisher)
+    RESOURCES.set("openai", stand_ins.llm)
+    RESOURCES.set("mongo", mongo_client)
+    RESOURCES.set("embeddings", CachedEmbeddings(stand_ins.embeddings))
+    RESOURCES.set("vector_store", stand_ins.vector_store)
+    RESOURCES.set("novu_dispatcher", EmailDispatcher("replay", api_url=stand_ins.novu.url, rate_limit=args.email_rate_limit,
+                                                     backoff=0.05))
+    import main
+    import notifier
+    import subscriber
+    return types.SimpleNamespace(main=main, subscriber=subscriber, notifier=notifier, db=db, stand_ins=stand_ins)
+
+
+def seed_users(collection, user_count, seed):
+    rng = random.Random(seed)
+    for start in range(0, user_count, 10000):
+        collection.insert_many([{"user_id": f"user{i}@example.com",
+                                 "preference": json.dumps({"topics": rng.sample(NEWSLETTER_TOPICS, rng.randint(1, 3))})}
+                                for i in range(start, min(start + 10000, user_count))], ordered=False)
+
+
+def _span_counts():
+    with span_duration._lock:
+        return {key: list(counts) for key, counts in span_duration.values.items()}
+
+
+def _bucket_bound(buckets, counts, quantile):
+    # Upper bound of the bucket holding the quantile, the histogram has no finer resolution
+    rank = quantile * counts[len(buckets)]
+    for bound, count in zip(buckets, counts):
+        if count >= rank:
+            return bound
+    return float("inf")
+
+
+class PhaseSpans:
+    """span_duration_seconds observations made during the runs of each phase."""
+
+    def __init__(self):
+        self.counts = {}
+
+    def add(self, phase, before, after):
+        for key, counts in after.items():
+            previous = before.get(key, [0] * len(counts))
+            total = self.counts.setdefault((phase,) + key, [0] * len(counts))
+            for i, (a, b) in enumerate(zip(counts, previous)):
+                total[i] += a - b
+
+    def stages(self):
+        stages = {}
+        for (phase, name, operation, outcome), counts in sorted(self.counts.items()):
+            count = counts[-2]
+            if not count:
+                continue
+            stage = f"{phase}.{name}.{operation}" if operation else f"{phase}.{name}"
+            if outcome != "ok":
+                stages.setdefault(stage, {})["errors"] = count
+                continue
+            stages.setdefault(stage, {}).update({
+                "count": count,
+                "mean_ms": round(counts[-1] / count * 1000, 3),
+                "p50_le_ms": _bucket_bound(span_duration.buckets, counts, 0.5) * 1000,
+                "p95_le_ms": _bucket_bound(span_duration.buckets, counts, 0.95) * 1000,
+            })
+        return stages
+
+
+def _phase(items, seconds, **extra):
+    stage = {"items": items, "seconds": round(seconds, 3), "throughput_per_s": round(items / seconds, 3) if seconds else 0.0}
+    stage.update(extra)
+    return stage
+
+
+def run_replay(args):
+    """
+    Run the pipeline for args.cycles cycles: scrape and publish, consume, then send newsletters.
+
+    Returns:
+        dict: Report with the run's config and a throughput or latency entry per stage
+    """
+    pipeline = load_pipeline(args)
+    stand_ins = pipeline.stand_ins
+    seed_users(pipeline.db["user_preferences"], args.users, args.seed)
+    fixtures = load_scrape_fixtures(args.fixtures)
+    urls = [fixtures[i % len(fixtures)]["url"] + ("" if i < len(fixtures) else f"#replay-{i}") for i in range(args.sources)]
+    # Every cycle is due and every page changed, so each one scrapes and publishes every source
+    scrape_cache = ScrapeCache(path=None, ttl=0)
+    spans = PhaseSpans()
+    totals = {"extract": [0, 0.0], "subscribe": [0, 0.0], "notify": [0, 0.0]}
+    articles = 0
+    processed = 0
+
+    def timed(phase, run):
+        before = _span_counts()
+        started = time.perf_counter()
+        result = run()
+        totals[phase][1] += time.perf_counter() - started
+        spans.add(phase, before, _span_counts())
+        return result
+
+    try:
+        for cycle in range(args.cycles):
+            stand_ins.firecrawl.next_cycle(urls, args.articles, args.story_words)
+            totals["extract"][0] += len(timed("extract", lambda: pipeline.main.run_extraction(scrape_cache, sources=urls)))
+
+            stored = pipeline.db["all_news"].count_documents({})
+            metrics = timed("subscribe", lambda: pipeline.subscriber.listen_to_queue(max_idle_polls=1))
+            totals["subscribe"][0] += metrics["processed"] - processed
+            processed = metrics["processed"]
+            articles += pipeline.db["all_news"].count_documents({}) - stored
+
+            metrics = timed("notify", pipeline.notifier.find_user_and_news)
+            totals["notify"][0] += metrics["sent"] if metrics else 0
+            print(f"Cycle {cycle + 1}/{args.cycles} done", file=sys.stderr)
+
+        # The last pages published again unchanged, as after losing scrape_cache.json, dedup drops every article
+        # Counted by ingested_at, articles stored again under their old cycle would not change the total
+        republished_at = datetime.now(timezone.utc)
+        pipeline.main.run_extraction(ScrapeCache(path=None, ttl=0), sources=urls)
+        pipeline.subscriber.listen_to_queue(max_idle_polls=1)
+        republished = pipeline.db["all_news"].count_documents({"ingested_at": {"$gt": republished_at}})
+    finally:
+        stand_ins.novu.close()
+
+    stages = {
+        "extract": _phase(*totals["extract"], scrapes=stand_ins.firecrawl.calls),
+        "subscribe": _phase(*totals["subscribe"], articles=articles,
+                            articles_per_s=round(articles / totals["subscribe"][1], 3) if totals["subscribe"][1] else 0.0,
+                            llm_calls=stand_ins.llm.calls, embedded_texts=stand_ins.embeddings.texts),
+        "notify": _phase(*totals["notify"], novu_requests=stand_ins.novu.requests),
+        "republish": {"items": republished},
+    }
+    stages.update(spans.stages())
+    config = {name: getattr(args, name) for name in ("sources", "articles", "users", "cycles", "story_words", "scrape_latency",
+                                                     "llm_latency", "llm_item_latency", "embedding_latency", "vector_latency",
+                                                     "email_latency", "email_rate_limit", "seed")}
+    return {"config": config, "stages": stages}
+
+
+def print_report(report):
+    print(f"{'stage':<32} {'items':>8} {'per_s':>10} {'mean_ms':>10} {'p50<=ms':>10} {'p95<=ms':>10}")
+    for stage, metrics in report["stages"].items():
+        items = metrics.get("items", metrics.get("count", ""))
+        columns = [f"{metrics[key]:>10}" if key in metrics else f"{'':>10}" for key in ("throughput_per_s", "mean_ms", "p50_le_ms", "p95_le_ms")]
+        print(f"{stage:<32} {items:>8} {' '.join(columns)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay the news pipeline end to end against local stand-ins. "
+                                                 "Set BENCH_MONGO_URI to use a scratch MongoDB instead of mongomock, "
+                                                 "its informatica_ai collections are cleared first.")
+    parser.add_argument("--sources", type=int, default=4)
+    parser.add_argument("--articles", type=int, default=200, help="New stories per cycle across all sources")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--story-words", type=int, default=60)
+    parser.add_argument("--fixtures", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "scrapes.jsonl"))
+    parser.add_argument("--scrape-latency", type=float, default=0.2)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-item-latency", type=float, default=0.01)
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--vector-latency", type=float, default=0.02)
+    parser.add_argument("--email-latency", type=float, default=0.02)
+    parser.add_argument("--email-rate-limit", type=float, default=EMAIL_RATE_LIMIT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", help="Write the report as JSON to this path")
+    parser.add_argument("--save-baseline", help="Write the report as the baseline to this path")
+    parser.add_argument("--baseline", help="Compare against the baseline at this path, exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--verbose", action="store_true", help="Keep the pipeline's own output")
+    args = parser.parse_args()
+
+    if args.verbose:
+        report = run_replay(args)
+    else:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            report = run_replay(args)
+    print_report(report)
+    if report["stages"]["republish"]["items"]:
+        print(f"Republishing unchanged pages stored {report['stages']['republish']['items']} articles again")
+        sys.exit(1)
+    for path in (args.report, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} at {args.tolerance:.0%} tolerance")
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+
+
+SCRAPE_CACHE_PATH = os.environ.get("SCRAPE_CACHE_PATH", os.path.join(os.path.dirname(__file__), "scrape_cache.json"))
+SCRAPE_CACHE_TTL = float(os.environ.get("SCRAPE_CACHE_TTL", 3600))
+SCRAPE_CACHE_MAX_ENTRIES = int(os.environ.get("SCRAPE_CACHE_MAX_ENTRIES", 256))
+
+# Prices, percentages and clock times change on every load of a finance page, the headlines don't
+_volatile_tokens = re.compile(r"[-+]?\d[\d,.:]*%?")
+
+
+def content_hash(content):
+    """Hash of the scraped content with whitespace and volatile numbers normalized away."""
+    normalized = _volatile_tokens.sub("", str(content))
+    normalized = " ".join(normalized.split()).lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class ScrapeCache:
+    """
+    Persistent per-url record of the last published scrape.
+
+    An entry holds the content hash and the time the url was last fetched. A url fetched
+    within the TTL is a hit and is not scraped again; content whose hash matches the last
+    published one is not published again. Entries are evicted least recently used first
+    once the cache holds more than max_entries urls.
+    """
+
+    def __init__(self, path=SCRAPE_CACHE_PATH, ttl=SCRAPE_CACHE_TTL, max_entries=SCRAPE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "published": 0, "skipped_publishes": 0}
+        self._load()
+
+    def _load(self):
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.entries = OrderedDict(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"Error loading scrape cache, starting empty: {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+    def is_fresh(self, url):
+        """True if the url was fetched within the TTL and can be skipped this cycle."""
+        entry = self.entries.get(url)
+        if entry and time.time() - entry["fetched_at"] < self.ttl:
+            self.entries.move_to_end(url)
+            self.stats["hits"] += 1
+            return True
+        self.stats["misses"] += 1
+        return False
+
+    def is_unchanged(self, url, content):
+        """True if the content matches the last published content for the url."""
+        entry = self.entries.get(url)
+        unchanged = entry is not None and entry["hash"] == content_hash(content)
+        if unchanged:
+            # Still counts as a fetch, so the TTL starts again
+            entry["fetched_at"] = time.time()
+            self.entries.move_to_end(url)
+            self.stats["skipped_publishes"] += 1
+            self._save()
+        return unchanged
+
+    def record(self, url, content):
+        """Remember the content as published for the url."""
+        self.entries[url] = {"hash": content_hash(content), "fetched_at": time.time()}
+        self.entries.move_to_end(url)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.stats["published"] += 1
+        self._save()
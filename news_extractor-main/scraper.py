@@ -0,0 +1,66 @@
+import asyncio
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from informatica_shared.instrumentation import span
+
+
+SCRAPE_CONCURRENCY = int(os.environ.get("SCRAPE_CONCURRENCY", 4))
+SCRAPE_TIMEOUT = float(os.environ.get("SCRAPE_TIMEOUT", 60))
+SCRAPE_RETRIES = int(os.environ.get("SCRAPE_RETRIES", 2))
+SCRAPE_BACKOFF = float(os.environ.get("SCRAPE_BACKOFF", 2))
+
+
+async def _scrape_source(url, fetch, loop, executor, semaphore, timeout, retries, backoff):
+    for attempt in range(retries + 1):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                with span("scrape", url=url, attempt=attempt + 1):
+                    result = await asyncio.wait_for(loop.run_in_executor(executor, fetch, url), timeout)
+                print(f"Scraped {url} in {time.perf_counter() - started:.2f}s")
+                return result
+            except asyncio.TimeoutError:
+                print(f"Timed out scraping {url} after {timeout}s (attempt {attempt + 1})")
+            except Exception as e:
+                print(f"Error scraping {url} (attempt {attempt + 1}): {e}")
+        if attempt < retries:
+            # Exponential backoff with jitter, outside the semaphore so other sources keep going
+            await asyncio.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+    return None
+
+
+async def _scrape_all(urls, fetch, concurrency, timeout, retries, backoff):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    # A timed out call keeps its thread until the SDK gives up, so leave room for the retries
+    executor = ThreadPoolExecutor(max_workers=concurrency * (retries + 1))
+    try:
+        results = await asyncio.gather(*[
+            _scrape_source(url, fetch, loop, executor, semaphore, timeout, retries, backoff)
+            for url in urls
+        ])
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return {url: result for url, result in zip(urls, results) if result is not None}
+
+
+def scrape_sources(urls, fetch, concurrency=SCRAPE_CONCURRENCY, timeout=SCRAPE_TIMEOUT,
+                   retries=SCRAPE_RETRIES, backoff=SCRAPE_BACKOFF):
+    """
+    Scrape all sources concurrently with a bounded pool.
+
+    Args:
+        urls: Source urls to scrape
+        fetch: Blocking callable taking a url and returning the scraped data
+        concurrency: Maximum number of scrapes in flight
+        timeout: Seconds allowed for a single attempt
+        retries: Extra attempts for a source that failed or timed out
+        backoff: Base delay in seconds between attempts
+
+    Returns:
+        dict: url -> scraped data, for the sources that succeeded
+    """
+    return asyncio.run(_scrape_all(list(urls), fetch, max(1, concurrency), timeout, retries, backoff))
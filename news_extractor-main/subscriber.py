@@ -1,97 +1,92 @@
 import os
-import time
-from azure.storage.queue import QueueServiceClient, QueueClient, QueueMessage, BinaryBase64DecodePolicy, BinaryBase64EncodePolicy
-import json
-from pymongo import MongoClient
-from certifi import where
-from openai import OpenAI
-from langchain_milvus import Milvus
-from langchain_openai import OpenAIEmbeddings
+from datetime import datetime
+from envelope import decode_envelope
+from consumer import ConsumerMetrics, QueueConsumer
+from ingest import ingest_news
+from dedup import NearDuplicateFilter
+from articles import message_cycle_id, news_articles, replace_cycle
+from summarizer import NewsSummarizer
+from informatica_shared.instrumentation import serve_metrics, trace
+from informatica_shared.resources import resource
+from clients import all_news, azure_queue, database, embeddings, mongo, openai_client, vector_store
 
 
-azure_queue_name = "raw-to-informatica-queue"
-azure_queue_url = "https://rawtoinformatica.queue.core.windows.net/raw-to-informatica-queue"
-azure_connection_string = os.environ["AZURE_CONNECTION_STRING"]
-ZILLIZ_URL = "https://in03-e5bab4e640f79fb.serverless.gcp-us-west1.cloud.zilliz.com"
-ZILLIZ_TOKEN = os.environ.get("ZILLIZ_TOKEN")
-vector_store = Milvus(embedding_function=OpenAIEmbeddings(), connection_args={"uri": ZILLIZ_URL, "token": ZILLIZ_TOKEN}, auto_id=True, collection_name="informatica_all_news")
+#JSON mode makes the model return a valid JSON object, so most responses need no repair
+OPENAI_JSON_MODE = os.environ.get("OPENAI_JSON_MODE", "true").lower() == "true"
+#Keeps the chat service's local index, at LOCAL_INDEX_PATH, in sync with Zilliz
+LOCAL_INDEX_SYNC = os.environ.get("LOCAL_INDEX_SYNC", "false").lower() == "true"
 
 
-openai_client = OpenAI()
-mongo_client = MongoClient(os.environ["MONGO_URI"], tlsCAFile=where())
-db = mongo_client["informatica_ai"]
-all_news_db = db["all_news"]
+def create_local_indexes():
+    if not LOCAL_INDEX_SYNC:
+        return []
+    from informatica_shared.local_index import LocalVectorIndex
+    return [LocalVectorIndex()]
 
-queue_client = QueueClient.from_connection_string(azure_connection_string, azure_queue_name, message_encode_policy=BinaryBase64EncodePolicy(), message_decode_policy=BinaryBase64DecodePolicy())
 
-def save_news_message_to_mongo(data):
+local_indexes = resource("local_indexes", create_local_indexes)
+summarizer = resource("summarizer", lambda: NewsSummarizer(openai_client.get(), json_mode=OPENAI_JSON_MODE), requires=(openai_client,))
+news_filter = resource("news_filter", lambda: NearDuplicateFilter(database()["news_signatures"]), requires=(mongo,))
+consumer_metrics = ConsumerMetrics()
+
+def save_news_message_to_mongo(data, cycle_id, fetched_at=None):
     try:
-        all_news_db.insert_one(data)
-        print("Data saved to MongoDB")
+        #One document per article, a redelivered message replaces the articles its earlier attempt stored
+        articles = news_articles(data, cycle_id=cycle_id, fetched_at=fetched_at)
+        replace_cycle(all_news.get(), cycle_id, articles)
+        print(f"{len(articles)} articles saved to MongoDB")
     except Exception as e:
         print(f"Error saving data to MongoDB: {e}")
+        raise
 
 def save_news_vector_to_zilliz(data):
     try:
-        vector_store.add_texts(str(data))
-        print("Data saved to Zilliz")
+        count = ingest_news(data, vector_store.get(), embeddings.get(), mirrors=local_indexes.get())
+        print(f"{count} news items saved to Zilliz, embedding cache {embeddings.get().stats()}")
     except Exception as e:
         print(f"Error saving data to Zilliz: {e}")
+        raise
 
 
-def clean_json(data):
-    try:
-        data = str(data)
-        data = " ".join(data.split())
-        data = data.replace("\n", " ")
-        data = data.replace("  ", " ")
-        data = data.replace("\\", "")
-        data = data.replace("```", "")
-        data = data.replace("```python", "")
-        data = data.replace("```json", "")
-        data = data.replace("```yaml", "")
-        data = data.replace("json", "")
-        data = data.replace("https://","")
-        data = data.replace("https:","")
-        return json.loads(data)
-    except json.JSONDecodeError as e:
-        print(f"JSON decoding error: {str(e)}")
-        return data
-    except Exception as e:
-        print(f"Error in cleaning data: {str(e)}")
-        return data
-
-def create_news_summaries(data):
+def create_news_summaries(data, source=None):
     print("Creating news summaries")
-    completion = openai_client.chat.completions.create(
-        model = 'gpt-4o',
-        messages=[{"role":"system","content":"You are a news summarizer, consider the raw json below, and give me response in a dictionary format, without any special chracters."},
-                  {"role":"system","content":"Required Format Strictly JSON - {'Yahoo News':['title':'title of the news','summary':'summary of the news/ Headline completed for proper grammer','link':'link to the news','topic':'Stocks or market impacted out of [Minerals, Technology, Real Estate, Politics, Healthcare, Energy, Consumer Goods, Financial Services, Telecommunications, Utilities, Electronics]'],'Bloomberg'....}"},
-                  {"role":"system","content":"use single quote for apostrophes , and double quote for key value pairs of json, and comma to separate the news sources, news source is key, its value is an array of dictionaries, each dictionary is a news item, with title, summary, link, topic"},
-                  {"role":"user","content":str(data)}])
-    return completion.choices[0].message.content
+    news_summaries = summarizer.get().summarize(data, source=source)
+    print(f"Summary chunk cache {summarizer.get().stats()}")
+    return news_summaries
 
-def listen_to_queue():
+def process_message(payload):
+    envelope = decode_envelope(payload)
+    #Continue the extractor's trace, legacy messages start a new one
+    with trace(envelope["trace_id"]):
+        process_envelope(envelope)
 
-    while True:
-        message = queue_client.receive_message()
-        if message:
-            print("Message received: {}".format(message.content))
-            queue_client.delete_message(message)
-            #base64 decode
-            # message = message.content.decode('utf-8')
-            # data = json.loads(message.content)
-            data = message.content
-            news_summaries = create_news_summaries(data)
-            news_summaries = clean_json(news_summaries)
-            print(news_summaries)
-            save_news_message_to_mongo(news_summaries)
+def process_envelope(envelope):
+    cycle_id = message_cycle_id(envelope)
+    with consumer_metrics.stage("summarize"):
+        news_summaries = create_news_summaries(envelope["markdown"], source=envelope["url"])
+    with consumer_metrics.stage("dedup"):
+        #Reserves the kept items, so messages processed in parallel drop the same story
+        news_summaries, reserved = news_filter.get().filter(news_summaries, cycle_id)
+    print(news_summaries)
+    if not any(news_summaries.values()):
+        print(f"No new news items, dedup stats {news_filter.get().stats}")
+        return
+    #Raise on failure so the message stays on the queue
+    try:
+        with consumer_metrics.stage("mongo"):
+            fetched_at = datetime.fromisoformat(envelope["fetched_at"]) if envelope["fetched_at"] else None
+            save_news_message_to_mongo(news_summaries, cycle_id, fetched_at=fetched_at)
+        with consumer_metrics.stage("zilliz"):
             save_news_vector_to_zilliz(news_summaries)
-        else:
-            print("No messages in queue")
+    except Exception:
+        #Other messages must not drop items that were never stored
+        news_filter.get().release(reserved)
+        raise
 
-    #wait 4 hours
-        time.sleep(14400)
+def listen_to_queue(max_idle_polls=None):
+    consumer = QueueConsumer(azure_queue.get(), process_message, metrics=consumer_metrics)
+    return consumer.run(max_idle_polls=max_idle_polls)
 
 if __name__ == "__main__":
+    serve_metrics()
     listen_to_queue()
\ No newline at end of file
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from informatica_shared.instrumentation import bind_context, record_llm_usage, span
+from informatica_shared.llm_json import parse_llm_json, validate_news_summaries
+from informatica_shared.tokens import count_tokens
+
+from common import RateLimiter
+
+
+SUMMARY_MODEL = os.environ.get("SUMMARY_MODEL", "gpt-4o")
+SUMMARY_CHUNK_TOKENS = int(os.environ.get("SUMMARY_CHUNK_TOKENS", 4000))
+SUMMARY_CONCURRENCY = int(os.environ.get("SUMMARY_CONCURRENCY", 4))
+#Requests per second allowed by the OpenAI tier, 0 for no limit
+SUMMARY_RATE_LIMIT = float(os.environ.get("SUMMARY_RATE_LIMIT", 0))
+SUMMARY_RETRIES = int(os.environ.get("SUMMARY_RETRIES", 4))
+SUMMARY_BACKOFF = float(os.environ.get("SUMMARY_BACKOFF", 2))
+SUMMARY_CACHE_SIZE = int(os.environ.get("SUMMARY_CACHE_SIZE", 10000))
+
+SUMMARY_PROMPT = [
+    {"role":"system","content":"You are a news summarizer, consider the raw json below, and give me response in a dictionary format, without any special chracters."},
+    {"role":"system","content":"Required Format Strictly JSON - {'Yahoo News':['title':'title of the news','summary':'summary of the news/ Headline completed for proper grammer','link':'link to the news','topic':'Stocks or market impacted out of [Minerals, Technology, Real Estate, Politics, Healthcare, Energy, Consumer Goods, Financial Services, Telecommunications, Utilities, Electronics]'],'Bloomberg'....}"},
+    {"role":"system","content":"use single quote for apostrophes , and double quote for key value pairs of json, and comma to separate the news sources, news source is key, its value is an array of dictionaries, each dictionary is a news item, with title, summary, link, topic"},
+]
+
+_paragraph_break = re.compile(r"\n\s*\n")
+
+
+def _retryable_errors():
+    # openai takes longer to import than the rest of the subscriber, so it is loaded on the first request
+    import openai
+    return openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError
+
+
+def _blocks(markdown, max_tokens):
+    # Paragraphs, with the ones over the limit broken into lines and then into slices
+    for paragraph in _paragraph_break.split(markdown):
+        if not paragraph.strip():
+            continue
+        if count_tokens(paragraph) <= max_tokens:
+            yield paragraph
+            continue
+        for line in paragraph.splitlines():
+            if count_tokens(line) <= max_tokens:
+                yield line
+                continue
+            step = max_tokens * 3
+            for i in range(0, len(line), step):
+                yield line[i:i + step]
+
+
+def split_markdown(markdown, max_tokens=SUMMARY_CHUNK_TOKENS):
+    """Split scraped markdown at paragraph boundaries into chunks of at most max_tokens."""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for block in _blocks(markdown, max_tokens):
+        tokens = count_tokens(block)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current = []
+            current_tokens = 0
+        current.append(block)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def _no_items(data):
+    """Whether parsed output is an object with no news items at all, like {} or {"Yahoo News": []}."""
+    return isinstance(data, dict) and all(not value or _no_items(value) for value in data.values())
+
+
+def merge_summaries(results):
+    """Merge {source: [items]} results of several chunks, dropping items seen in an earlier chunk."""
+    merged = {}
+    seen = set()
+    for result in results:
+        for source, items in result.items():
+            for item in items:
+                key = (item["title"], item["link"])
+                if key in seen:
+                    continue
+                seen.add(key)
+                merged.setdefault(source, []).append(item)
+    return merged
+
+
+class NewsSummarizer:
+    """
+    Map-reduce summarization of a scraped page.
+
+    The page is split into token-bounded chunks which are summarized concurrently on a
+    pool shared by every message, and the chunk results are merged into one
+    {source: [news items]} dict. Requests are rate limited and retried with jittered
+    backoff on rate limit, connection and server errors. Chunk results are cached by
+    content hash, so a page that changed in one place only resummarizes that chunk.
+    """
+
+    def __init__(self, client, model=SUMMARY_MODEL, chunk_tokens=SUMMARY_CHUNK_TOKENS, concurrency=SUMMARY_CONCURRENCY,
+                 rate_limit=SUMMARY_RATE_LIMIT, retries=SUMMARY_RETRIES, backoff=SUMMARY_BACKOFF,
+                 cache_size=SUMMARY_CACHE_SIZE, json_mode=True):
+        self.client = client
+        self.model = model
+        self.chunk_tokens = chunk_tokens
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.retries = retries
+        self.backoff = backoff
+        self.json_mode = json_mode
+        self.pool = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._prompt_hash = hashlib.sha256(json.dumps([model, SUMMARY_PROMPT, json_mode]).encode("utf-8")).hexdigest()
+
+    def _key(self, content):
+        return hashlib.sha256(f"{self._prompt_hash}\0{content}".encode("utf-8")).hexdigest()
+
+    def _cached(self, key):
+        with self._lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key]
+            self.misses += 1
+            return None
+
+    def _remember(self, key, result):
+        with self._lock:
+            self.cache[key] = result
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def complete(self, content):
+        """Raw model output for one chunk."""
+        retryable = _retryable_errors()
+        options = {"response_format": {"type": "json_object"}} if self.json_mode else {}
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.acquire()
+            started = time.perf_counter()
+            try:
+                completion = self.client.chat.completions.create(
+                    model = self.model,
+                    messages = SUMMARY_PROMPT + [{"role":"user","content":content}],
+                    **options)
+                record_llm_usage(self.model, "news_summary", time.perf_counter() - started, getattr(completion, "usage", None))
+                return completion.choices[0].message.content
+            except retryable as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                response = getattr(e, "response", None)
+                retry_after = response.headers.get("retry-after") if response is not None else None
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+                print(f"Error summarizing chunk (attempt {attempt + 1}), retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+
+    def _summarize_chunk(self, content):
+        key = self._key(content)
+        result = self._cached(key)
+        if result is not None:
+            return result
+        with span("summarize_chunk", tokens=count_tokens(content)):
+            output = self.complete(content)
+        parsed = parse_llm_json(output, allow_prose=True)
+        result = validate_news_summaries(parsed)
+        if result is None:
+            if not _no_items(parsed):
+                # Garbled, refused or truncated output, raise so the message is retried instead of caching it
+                raise ValueError(f"Invalid summary output for chunk: {str(output)[:200]}")
+            # Navigation and footers legitimately have no news
+            print(f"No news items in chunk output: {str(output)[:200]}")
+            result = {}
+        self._remember(key, result)
+        return result
+
+    def summarize(self, markdown, source=None):
+        """
+        Summarize a scraped page.
+
+        Args:
+            markdown: Scraped page content
+            source: Source url, repeated at the top of every chunk
+
+        Returns:
+            dict: news source -> list of news items
+        """
+        header = f"Source: {source}\n" if source else ""
+        chunks = [header + chunk for chunk in split_markdown(markdown, self.chunk_tokens)]
+        # Raises if any chunk failed, the chunks that succeeded stay cached for the retry
+        return merge_summaries(self.pool.map(bind_context(self._summarize_chunk), chunks))
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / total, 3) if total else 0.0}
@@ -0,0 +1,6 @@
+"""Modules shared by the news extractor and chat services."""
+import os
+
+
+#Default location of the files both services on a host read and write, like the embedding cache and local index
+DATA_DIR = os.environ.get("INFORMATICA_DATA_DIR", os.path.join(os.path.expanduser("~"), ".cache", "informatica_ai"))
@@ -0,0 +1,25 @@
+def compare_to_baseline(report, baseline, tolerance, floor_ms=1.0, min_count=20):
+    """
+    Regressions of a replay report against a baseline report.
+
+    A throughput (*_per_s) below baseline * (1 - tolerance) or a latency (*_ms) above
+    baseline * (1 + tolerance) is a regression. Latencies under floor_ms, or of stages
+    seen fewer than min_count times, are too noisy to compare.
+
+    Returns:
+        list: One line per regression
+    """
+    if report["config"] != baseline["config"]:
+        print(f"Baseline was recorded with a different config: {baseline['config']}")
+    regressions = []
+    for stage, expected in baseline["stages"].items():
+        actual = report["stages"].get(stage, {})
+        for key, value in expected.items():
+            if key not in actual or not value:
+                continue
+            if key.endswith("_per_s") and actual[key] < value * (1 - tolerance):
+                regressions.append(f"{stage} {key}: {value} -> {actual[key]}")
+            elif (key.endswith("_ms") and min(expected.get("count", 0), actual.get("count", 0)) >= min_count
+                  and max(value, actual[key]) >= floor_ms and actual[key] > value * (1 + tolerance)):
+                regressions.append(f"{stage} {key}: {value} -> {actual[key]}")
+    return regressions
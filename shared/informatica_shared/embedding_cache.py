@@ -0,0 +1,123 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+from informatica_shared import DATA_DIR
+
+
+#One file for both services, so a text embedded by one is a hit for the other
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", os.path.join(DATA_DIR, "embedding_cache.sqlite3"))
+EMBEDDING_CACHE_LRU_SIZE = int(os.environ.get("EMBEDDING_CACHE_LRU_SIZE", 10000))
+
+
+def embedding_key(model, text):
+    """Content address of a text for a model, insensitive to whitespace differences."""
+    normalized = " ".join(str(text).split())
+    return hashlib.sha256(f"{model}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only calls the wrapped embedding function for unseen texts.
+
+    Vectors are keyed by model and normalized text hash, kept in an in-process LRU and
+    persisted to SQLite so they survive restarts and can be shared by every process
+    pointing at the same file.
+    """
+
+    def __init__(self, embedding, path=EMBEDDING_CACHE_PATH, lru_size=EMBEDDING_CACHE_LRU_SIZE, model=None):
+        self.embedding = embedding
+        self.model = model or getattr(embedding, "model", type(embedding).__name__)
+        self.lru_size = lru_size
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Other processes write the same file, wait for their locks instead of failing
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._db.commit()
+
+    def _remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.lru_size:
+            self.memory.popitem(last=False)
+
+    def _lookup(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+                    self.hits += 1
+            missing = [key for key in keys if key not in found]
+            # Stay well under SQLite's bound parameter limit
+            for i in range(0, len(missing), 500):
+                batch = missing[i:i + 500]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch)
+                for key, blob in rows:
+                    vector = array("f", blob).tolist()
+                    found[key] = vector
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+        return found
+
+    def _store(self, vectors):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in vectors.items()])
+            self._db.commit()
+            for key, vector in vectors.items():
+                self._remember(key, vector)
+
+    def embed_documents(self, texts):
+        keys = [embedding_key(self.model, text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+
+        # Embed each distinct missing text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            with self._lock:
+                self.misses += len(missing)
+            vectors = self.embedding.embed_documents(list(missing.values()))
+            embedded = dict(zip(missing.keys(), vectors))
+            self._store(embedded)
+            found.update(embedded)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        key = embedding_key(self.model, text)
+        found = self._lookup([key])
+        if key in found:
+            return found[key]
+        with self._lock:
+            self.misses += 1
+        vector = self.embedding.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / total, 3) if total else 0.0,
+            }
@@ -0,0 +1,339 @@
+import atexit
+import contextvars
+import functools
+import glob
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+#Print a JSON line per finished span
+TRACE_LOG = os.environ.get("TRACE_LOG", "false").lower() == "true"
+#Port of the Prometheus metrics endpoint of the worker processes, 0 for none
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+#Directory shared by the worker processes of a service, each writes its metrics there and /metrics adds
+#up every file. Clear it before the service starts, files of stopped workers keep their counts.
+METRICS_MULTIPROC_DIR = os.environ.get("METRICS_MULTIPROC_DIR")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", 5))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_span_id = contextvars.ContextVar("span_id", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            return {"type": self.type, "documentation": self.documentation, "labelnames": self.labelnames,
+                    "values": [[list(key), value] for key, value in self.values.items()]}
+
+
+class Counter(_Metric):
+    """Monotonic Prometheus counter with labels."""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    @staticmethod
+    def merge(total, value):
+        return total + value
+
+    def samples(self, values=None):
+        with self._lock:
+            values = dict(self.values if values is None else values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    """Prometheus histogram with cumulative buckets, a sum and a count per label set."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # One count per bucket, then +Inf, then the sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot["buckets"] = self.buckets
+        return snapshot
+
+    @staticmethod
+    def merge(total, counts):
+        return [a + b for a, b in zip(total, counts)]
+
+    def samples(self, values=None):
+        lines = []
+        with self._lock:
+            values = {key: list(counts) for key, counts in (self.values if values is None else values).items()}
+        for key, counts in values.items():
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {counts[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {counts[-2]}")
+        return lines
+
+
+class Registry:
+    """Metrics of this process, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.type}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, documentation, labelnames, buckets)
+
+    def write(self, directory):
+        """Replace this process's file in a multiprocess metrics directory."""
+        with self._lock:
+            metrics = list(self.metrics.values())
+        path = os.path.join(directory, f"metrics_{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump({metric.name: metric.snapshot() for metric in metrics}, f)
+        os.replace(path + ".tmp", path)
+
+    def collect(self, directory):
+        """Metrics and values added up across the files of every process in directory."""
+        self.write(directory)
+        with self._lock:
+            metrics = dict(self.metrics)
+        totals = {}
+        for path in glob.glob(os.path.join(directory, "metrics_*.json")):
+            try:
+                with open(path) as f:
+                    snapshots = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, snapshot in snapshots.items():
+                metric = metrics.get(name)
+                if metric is None:
+                    cls = Histogram if snapshot["type"] == "histogram" else Counter
+                    metric = metrics[name] = cls(name, snapshot["documentation"], snapshot["labelnames"],
+                                                 **({"buckets": snapshot["buckets"]} if "buckets" in snapshot else {}))
+                values = totals.setdefault(name, {})
+                for key, value in snapshot["values"]:
+                    key = tuple(key)
+                    values[key] = metric.merge(values[key], value) if key in values else value
+        return [(metric, totals.get(name, {})) for name, metric in metrics.items()]
+
+    def render(self):
+        lines = []
+        if METRICS_MULTIPROC_DIR:
+            metrics = self.collect(METRICS_MULTIPROC_DIR)
+        else:
+            with self._lock:
+                metrics = [(metric, None) for metric in self.metrics.values()]
+        for metric, values in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples(values))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+render_metrics = REGISTRY.render
+
+#operation tells apart spans of the same name, like the queries of a mongo span
+span_duration = histogram("span_duration_seconds", "Duration of traced operations", ("span", "operation", "outcome"))
+llm_duration = histogram("llm_request_duration_seconds", "Duration of LLM requests", ("model", "operation"))
+llm_tokens = counter("llm_tokens_total", "Tokens used by LLM requests", ("model", "operation", "kind"))
+
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+@contextmanager
+def trace(trace_id=None):
+    """Run the block in a trace, a new one unless trace_id continues one from another process."""
+    token = _trace_id.set(trace_id or new_trace_id())
+    try:
+        yield _trace_id.get()
+    finally:
+        _trace_id.reset(token)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a block as a span of the current trace.
+
+    The duration goes to the span_duration_seconds histogram, labelled with the operation
+    attribute if there is one, and with TRACE_LOG to a JSON line with the trace and parent
+    span ids. The attributes dict is yielded so the block can add to it.
+    """
+    trace_token = _trace_id.set(_trace_id.get() or new_trace_id())
+    parent = _span_id.get()
+    span_token = _span_id.set(uuid.uuid4().hex[:16])
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield attributes
+    except BaseException as e:
+        outcome = "error"
+        attributes["error"] = repr(e)
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        span_duration.observe(duration, span=name, operation=attributes.get("operation", ""), outcome=outcome)
+        if TRACE_LOG:
+            print(json.dumps({"span": name, "trace_id": _trace_id.get(), "span_id": _span_id.get(), "parent_id": parent,
+                              "duration_s": round(duration, 6), "outcome": outcome, **attributes}, default=str))
+        _span_id.reset(span_token)
+        _trace_id.reset(trace_token)
+
+
+def timed(name=None):
+    """Decorator running each call of a function or coroutine function in a span."""
+    def decorator(fn):
+        span_name = name or fn.__name__
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind_context(fn):
+    """fn running in the caller's trace, for work handed to a thread pool."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+def record_llm_usage(model, operation, seconds, usage=None):
+    """Latency and, when the response has usage, token counts of an LLM request."""
+    llm_duration.observe(seconds, model=model, operation=operation)
+    for kind in ("prompt_tokens", "completion_tokens"):
+        tokens = getattr(usage, kind, None)
+        if tokens:
+            llm_tokens.inc(tokens, model=model, operation=operation, kind=kind.split("_")[0])
+
+
+def share_metrics(directory=METRICS_MULTIPROC_DIR, interval=METRICS_FLUSH_SECONDS):
+    """
+    Write this process's metrics to directory every interval seconds and at exit, if set,
+    so the /metrics of any worker process reports the whole service.
+    """
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+
+    def flush():
+        while True:
+            time.sleep(interval)
+            try:
+                REGISTRY.write(directory)
+            except OSError as e:
+                print(f"Could not write metrics to {directory}: {e}")
+
+    REGISTRY.write(directory)
+    atexit.register(REGISTRY.write, directory)
+    thread = threading.Thread(target=flush, daemon=True)
+    thread.start()
+    return thread
+
+
+def serve_metrics(port=METRICS_PORT):
+    """Expose render_metrics on http://0.0.0.0:port/metrics from a daemon thread, if port is set."""
+    if not port:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            data = render_metrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,214 @@
+import json
+import re
+
+
+NEWS_ITEM_FIELDS = ("title", "summary", "link", "topic")
+
+_fence = re.compile(r"```[\w+-]*[ \t]*\n?(.*?)```", re.S)
+_token = re.compile(r"[\w.+-]+")
+_number = re.compile(r"-?\d+(\.\d+)?([eE][-+]?\d+)?$")
+_literals = {"True": "true", "False": "false", "None": "null", "true": "true", "false": "false", "null": "null"}
+_escapes = set('"\\/bfnrtu')
+_closers = {"{": "}", "[": "]"}
+# A quote ends a string only when it is followed by one of these, otherwise it is part of the text
+_after_string = set(',:}]"\'')
+
+
+def strip_code_fences(text):
+    """Content of the first fenced block, or the text without a dangling opening fence."""
+    match = _fence.search(text)
+    if match:
+        return match.group(1)
+    if text.startswith("```"):
+        return text.split("\n", 1)[1] if "\n" in text else ""
+    return text
+
+
+def _closes_string(text, index, quote):
+    # Of a doubled quote, as in "calls it "cheap"", the second one closes the string
+    if text[index:index + 1] == quote:
+        return False
+    while index < len(text) and text[index].isspace():
+        index += 1
+    return index == len(text) or text[index] in _after_string
+
+
+def _repair(text, start):
+    out = []
+    stack = []
+    quote = None
+    need_comma = False
+    i, n = start, len(text)
+    while i < n:
+        ch = text[i]
+        if quote:
+            if ch == "\\":
+                following = text[i + 1:i + 2]
+                if following in _escapes and following:
+                    out.append(ch + following)
+                elif following == "'":
+                    out.append("'")
+                # Any other escape, like the \_ in scraped markdown, loses its backslash
+                i += 2 if following in _escapes or following == "'" else 1
+                continue
+            if ch == quote and _closes_string(text, i + 1, quote):
+                out.append('"')
+                quote = None
+                need_comma = True
+            elif ch == '"':
+                out.append('\\"')
+            elif ch == "\n":
+                out.append("\\n")
+            elif ch == "\r":
+                out.append("\\r")
+            elif ch == "\t":
+                out.append("\\t")
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        if ch == '"' or ch == "'":
+            if need_comma:
+                out.append(",")
+            out.append('"')
+            quote = ch
+            need_comma = False
+        elif ch == "{" or ch == "[":
+            if need_comma:
+                out.append(",")
+            stack.append(ch)
+            out.append(ch)
+            need_comma = False
+        elif ch == "}" or ch == "]":
+            if out and out[-1] == ",":
+                out.pop()
+            if stack:
+                out.append(_closers[stack.pop()])
+            need_comma = True
+            if not stack:
+                i += 1
+                break
+        elif ch == ",":
+            if need_comma:
+                out.append(",")
+                need_comma = False
+        elif ch == ":":
+            out.append(":")
+            need_comma = False
+        elif not ch.isspace():
+            match = _token.match(text, i)
+            if match:
+                token = match.group()
+                if need_comma:
+                    out.append(",")
+                if token in _literals:
+                    out.append(_literals[token])
+                elif _number.match(token):
+                    out.append(token)
+                else:
+                    out.append(json.dumps(token))
+                need_comma = True
+                i = match.end()
+                continue
+        i += 1
+
+    # Close whatever a truncated response left open
+    if quote:
+        out.append('"')
+    if out and out[-1] == ":":
+        out.append("null")
+    elif out and out[-1] == ",":
+        out.pop()
+    while stack:
+        out.append(_closers[stack.pop()])
+    return "".join(out), i
+
+
+def repair_json(text, start=0):
+    """
+    Rewrite almost-JSON into JSON in a single pass over the text.
+
+    Handles single quoted strings, apostrophes and stray double quotes inside strings, raw
+    newlines and invalid escapes in strings, Python True/False/None, unquoted keys, missing
+    and trailing commas, text after the top level value, and output truncated mid-value.
+    """
+    return _repair(text, start)[0]
+
+
+def parse_llm_json(text, allow_prose=False, default=None):
+    """
+    Parse JSON out of an LLM response.
+
+    Valid JSON is parsed directly. Otherwise code fences are stripped and the first JSON
+    value is repaired with repair_json.
+
+    Args:
+        text: Model output, dicts and lists are returned as they are
+        allow_prose: Accept prose around the JSON value, otherwise the text must be nothing
+            but the value
+        default: Returned when no JSON value can be recovered
+
+    Returns:
+        The parsed value, or default
+    """
+    if isinstance(text, (dict, list)):
+        return text
+    if text is None:
+        return default
+    text = str(text).strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+
+    text = strip_code_fences(text).strip()
+    if allow_prose:
+        starts = [index for index in (text.find("{"), text.find("[")) if index >= 0]
+        if not starts:
+            return default
+        start = min(starts)
+    elif text[:1] in ("{", "["):
+        start = 0
+    else:
+        return default
+    repaired, end = _repair(text, start)
+    if not allow_prose and text[end:].strip():
+        return default
+    try:
+        return json.loads(repaired)
+    except ValueError:
+        return default
+
+
+def validate_news_summaries(data):
+    """
+    Check parsed summarizer output against the {source: [news items]} schema.
+
+    Items without a title or summary are dropped, fields are coerced to strings and a single
+    wrapping key, like {"news": {...}}, is unwrapped.
+
+    Returns:
+        dict: The valid sources and items, or None if nothing valid is left
+    """
+    if not isinstance(data, dict):
+        return None
+    if len(data) == 1:
+        inner = next(iter(data.values()))
+        if isinstance(inner, dict) and all(isinstance(value, (list, dict)) for value in inner.values()):
+            data = inner
+
+    summaries = {}
+    for source, items in data.items():
+        if isinstance(items, dict):
+            items = [items]
+        if not isinstance(items, list):
+            continue
+        valid = []
+        for item in items:
+            if not isinstance(item, dict) or not (item.get("title") or item.get("summary")):
+                continue
+            valid.append({field: str(item.get(field) or "") for field in NEWS_ITEM_FIELDS})
+        if valid:
+            summaries[str(source)] = valid
+    return summaries or None
@@ -0,0 +1,197 @@
+import fcntl
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+from langchain_core.documents import Document
+
+from informatica_shared import DATA_DIR
+
+
+#Written by the news subscriber and read by the chat workers
+LOCAL_INDEX_PATH = os.environ.get("LOCAL_INDEX_PATH", os.path.join(DATA_DIR, "local_index"))
+#Weight of vector similarity against BM25 keyword score, 1 for vector search only
+RETRIEVAL_HYBRID_ALPHA = float(os.environ.get("RETRIEVAL_HYBRID_ALPHA", 1))
+
+_word = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return _word.findall(text.lower())
+
+
+class LocalVectorIndex:
+    """
+    In-process brute force vector index persisted to a memory-mapped file.
+
+    Vectors are normalized float32 rows appended to vectors.f32, and their texts and
+    metadata are lines of documents.jsonl. Writers append under a file lock and readers
+    pick up new rows on their next search, so a subscriber writing the index keeps every
+    chat worker reading it in sync. Searches score every row by cosine similarity,
+    optionally blended with BM25 over the texts, with optional topic and recency filters.
+    """
+
+    def __init__(self, path=LOCAL_INDEX_PATH, embedding_function=None, hybrid_alpha=RETRIEVAL_HYBRID_ALPHA,
+                 k1=1.5, b=0.75):
+        self.path = path
+        self.embedding_function = embedding_function
+        self.hybrid_alpha = hybrid_alpha
+        self.k1 = k1
+        self.b = b
+        os.makedirs(path, exist_ok=True)
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.documents_path = os.path.join(path, "documents.jsonl")
+        self.lock_path = os.path.join(path, "index.lock")
+        self.dim = None
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.documents = []
+        self.topics = []
+        self.ingested_at = []
+        self._offset = 0
+        # BM25 statistics, postings are term -> (rows, term frequencies)
+        self.postings = defaultdict(lambda: ([], []))
+        self.lengths = []
+        self._columns = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        self.refresh()
+        return len(self.documents)
+
+    def _load_documents(self):
+        if not os.path.exists(self.documents_path):
+            return
+        with open(self.documents_path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        # A line still being written has no newline yet
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            document = json.loads(line)
+            row = len(self.documents)
+            if self.dim is None:
+                self.dim = document["dim"]
+            metadata = document["metadata"]
+            terms = Counter(tokenize(document["text"]))
+            for term, count in terms.items():
+                rows, counts = self.postings[term]
+                rows.append(row)
+                counts.append(count)
+            self.lengths.append(sum(terms.values()))
+            self.topics.append(metadata.get("topic", ""))
+            self.ingested_at.append(metadata.get("ingested_at", 0.0))
+            self.documents.append(document)
+        self._offset += end
+
+    def refresh(self):
+        """Load rows appended since the last refresh."""
+        with self._lock:
+            try:
+                size = os.path.getsize(self.documents_path)
+            except OSError:
+                return
+            if size == self._offset:
+                return
+            self._load_documents()
+            if self.documents and len(self.vectors) != len(self.documents):
+                self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(len(self.documents), self.dim))
+
+    def _column(self, name, rows_total):
+        # Arrays of per-row metadata, rebuilt only when rows were added
+        column = self._columns.get(name)
+        if column is None or len(column) != rows_total:
+            column = np.asarray(getattr(self, name)[:rows_total])
+            self._columns[name] = column
+        return column
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, **kwargs):
+        """Append rows, same signature as the LangChain vector stores so ingest_news can write here."""
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        now = time.time()
+        with open(self.lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.refresh()
+            if self.dim is not None and vectors.shape[1] != self.dim:
+                raise ValueError(f"Index holds {self.dim} dimensional vectors, got {vectors.shape[1]}")
+            # Drop vectors a crashed writer left without their documents
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(len(self.documents) * vectors.shape[1] * 4)
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.documents_path, "a", encoding="utf-8") as f:
+                for text, metadata in zip(texts, metadatas):
+                    metadata = dict(metadata, ingested_at=metadata.get("ingested_at", now))
+                    f.write(json.dumps({"text": text, "metadata": metadata, "dim": vectors.shape[1]}) + "\n")
+        self.refresh()
+        return list(range(len(self.documents) - len(texts), len(self.documents)))
+
+    def _bm25(self, query, rows_total):
+        scores = np.zeros(rows_total, dtype=np.float32)
+        lengths = np.asarray(self.lengths[:rows_total], dtype=np.float32)
+        average = lengths.mean()
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            rows, counts = self.postings[term]
+            matched = min(len(rows), len(counts))
+            rows = np.asarray(rows[:matched])
+            counts = np.asarray(counts[:matched], dtype=np.float32)
+            # Rows loaded after the search started are left out
+            keep = rows < rows_total
+            rows, counts = rows[keep], counts[keep]
+            idf = math.log(1 + (rows_total - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[rows] / average)
+            scores[rows] += idf * counts * (self.k1 + 1) / (counts + norm)
+        return scores
+
+    def search(self, vector, k=4, query=None, topics=None, since=None):
+        """
+        Rows most similar to the vector.
+
+        Args:
+            vector: Query embedding
+            k: Number of results
+            query: Query text, blended in with BM25 when hybrid_alpha is below 1
+            topics: Only return rows with one of these topics
+            since: Only return rows ingested at or after this time, a datetime or timestamp
+
+        Returns:
+            list: (Document, score) pairs, best first
+        """
+        self.refresh()
+        # Rows only ever get appended, so everything up to the current vectors stays valid
+        vectors = self.vectors
+        rows_total = len(vectors)
+        if not rows_total:
+            return []
+        vector = np.asarray(vector, dtype=np.float32)
+        scores = vectors @ (vector / max(np.linalg.norm(vector), 1e-12))
+        if query and self.hybrid_alpha < 1:
+            keyword_scores = self._bm25(query, rows_total)
+            top = keyword_scores.max()
+            if top > 0:
+                scores = self.hybrid_alpha * scores + (1 - self.hybrid_alpha) * keyword_scores / top
+        if topics is not None:
+            scores = np.where(np.isin(self._column("topics", rows_total), list(topics)), scores, -np.inf)
+        if since is not None:
+            since = since.timestamp() if hasattr(since, "timestamp") else since
+            scores = np.where(self._column("ingested_at", rows_total) >= since, scores, -np.inf)
+
+        k = min(k, rows_total)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(Document(page_content=self.documents[row]["text"], metadata=self.documents[row]["metadata"]), float(scores[row]))
+                for row in top if scores[row] != -np.inf]
+
+    def similarity_search(self, query, k=4, topics=None, since=None, **kwargs):
+        """LangChain style search by query text."""
+        vector = self.embedding_function.embed_query(query)
+        return [document for document, _ in self.search(vector, k=k, query=query, topics=topics, since=since)]
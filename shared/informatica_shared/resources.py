@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+
+
+#Seconds between health checks of a shared client, run by the next get after the interval
+RESOURCE_HEALTH_INTERVAL = float(os.environ.get("RESOURCE_HEALTH_INTERVAL", 30))
+
+
+class Resource:
+    """
+    A client created on first use and shared by every thread of the process.
+
+    The factory runs on the first get, so importing a module that declares resources
+    loads no client library and opens no connection. It runs again in a forked child,
+    since the parent's sockets and locks can't be shared, after a resource it requires
+    was rebuilt, and, with a health_check, when the client fails a check. Checks run on
+    get at most every health_interval seconds, and a failed client is closed with close.
+    """
+
+    def __init__(self, name, factory=None, health_check=None, close=None, requires=(),
+                 health_interval=RESOURCE_HEALTH_INTERVAL):
+        self.name = name
+        self.factory = factory
+        self.health_check = health_check
+        self.close = close
+        self.requires = tuple(requires)
+        self.health_interval = health_interval
+        self.builds = 0
+        self.failed_checks = 0
+        self.last_error = None
+        self._value = None
+        self._pinned = False
+        self._pid = None
+        self._checked = 0.0
+        self._required_builds = ()
+        self._lock = threading.RLock()
+
+    def _stale(self):
+        if self._pid != os.getpid():
+            return True
+        for resource in self.requires:
+            resource.get()
+        return any(resource.builds != builds for resource, builds in self._required_builds)
+
+    def _check_due(self):
+        return self.health_check is not None and time.monotonic() - self._checked >= self.health_interval
+
+    def _discard(self):
+        value, self._value = self._value, None
+        if self.close is not None and self._pid == os.getpid():
+            try:
+                self.close(value)
+            except Exception as e:
+                self.last_error = repr(e)
+
+    def _check(self):
+        self._checked = time.monotonic()
+        try:
+            healthy = self.health_check(self._value) is not False
+        except Exception as e:
+            healthy = False
+            self.last_error = repr(e)
+        if not healthy:
+            self.failed_checks += 1
+            self._discard()
+
+    def get(self):
+        """The shared client, created or recreated first if needed."""
+        value = self._value
+        if self._pinned or (value is not None and not self._stale() and not self._check_due()):
+            return value
+        with self._lock:
+            if self._pinned:
+                return self._value
+            if self._value is not None:
+                if self._stale():
+                    self._discard()
+                elif self._check_due():
+                    self._check()
+            if self._value is None:
+                if self.factory is None:
+                    raise RuntimeError(f"Resource {self.name} has no factory")
+                value = self.factory()
+                # Taken after the factory, which gets the resources it builds on
+                self._required_builds = tuple((resource, resource.builds) for resource in self.requires)
+                self._value, self._pid, self._checked = value, os.getpid(), time.monotonic()
+                self.builds += 1
+            return self._value
+
+    def peek(self):
+        """The client if this process created it, without creating it."""
+        if self._pinned or self._pid == os.getpid():
+            return self._value
+        return None
+
+    def set(self, value):
+        """Use value instead of a client from the factory, for tests and benchmarks."""
+        with self._lock:
+            self._value, self._pinned, self._pid = value, True, os.getpid()
+            self.builds += 1
+
+    def reset(self):
+        """Close the client, the next get creates a new one."""
+        with self._lock:
+            if not self._pinned:
+                self._discard()
+            self._value, self._pinned = None, False
+
+    def status(self):
+        return {"created": self.peek() is not None, "builds": self.builds, "failed_checks": self.failed_checks,
+                "last_error": self.last_error}
+
+
+class ResourceRegistry:
+    """Resources of this process by name, so modules declaring the same client share it."""
+
+    def __init__(self):
+        self.resources = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name):
+        with self._lock:
+            resource = self.resources.get(name)
+            if resource is None:
+                resource = self.resources[name] = Resource(name)
+            return resource
+
+    def register(self, name, factory, **options):
+        """The resource registered under name, declared with factory if it is new."""
+        resource = self._get(name)
+        with resource._lock:
+            if resource.factory is None:
+                resource.factory = factory
+                for option, value in options.items():
+                    setattr(resource, option, tuple(value) if option == "requires" else value)
+        return resource
+
+    def __getitem__(self, name):
+        return self.resources[name]
+
+    def set(self, name, value):
+        """Pin a resource to value, before or after it is declared."""
+        self._get(name).set(value)
+
+    def status(self):
+        with self._lock:
+            resources = list(self.resources.values())
+        return {resource.name: resource.status() for resource in resources}
+
+    def reset(self):
+        with self._lock:
+            resources = list(self.resources.values())
+        for resource in resources:
+            resource.reset()
+
+
+RESOURCES = ResourceRegistry()
+resource = RESOURCES.register
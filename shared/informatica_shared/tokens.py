@@ -0,0 +1,28 @@
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+
+
+def load_encoding():
+    """Load the o200k encoding used by gpt-4o, downloading it on first use, returns False when it can't be loaded."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.error(f"Error loading tiktoken encoding, estimating tokens: {str(e)}")
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    """Token count with the o200k encoding, or an estimate on the high side when it can't be loaded."""
+    encoding = load_encoding()
+    if encoding is False:
+        return len(text) // 3
+    # Scraped pages and chat messages are plain text, special token markup in them is counted as text
+    return len(encoding.encode(text, disallowed_special=()))